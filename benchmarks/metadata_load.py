@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# Copyright SUSE LLC
+# SPDX-License-Identifier: MIT
+"""Compare yaml backends loading a synthetic metadata directory
+
+Usage: python3 benchmarks/metadata_load.py [number of files]
+"""
+
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from openqabot.loader import config
+
+FLAVOR = """\
+    Server-DVD-Incidents-%(n)s:
+      archs: [x86_64, aarch64, s390x, ppc64le]
+      aggregate_job: false
+      issues:
+        BASE_TEST_ISSUES: SLE-Module-Basesystem:15-SP%(sp)s
+        OS_TEST_ISSUES: SLES:15-SP%(sp)s
+        SERVER_TEST_ISSUES: SLE-Module-Server-Applications:15-SP%(sp)s
+      packages: [kernel-source, kernel-azure, kernel-rt, xen, qemu]
+"""
+
+CONFIG = """\
+product: SLES15SP%(sp)s_%(n)s
+settings:
+  VERSION: 15-SP%(sp)s
+  DISTRI: sle
+  PUBLISH_HDD_1: sle-15-SP%(sp)s-%(n)s.qcow2
+aggregate:
+  FLAVOR: Server-DVD-Updates
+  archs: [x86_64, aarch64, s390x, ppc64le]
+  test_issues:
+    BASE_TEST_ISSUES: SLE-Module-Basesystem:15-SP%(sp)s
+    OS_TEST_ISSUES: SLES:15-SP%(sp)s
+incidents:
+  FLAVOR:
+%(flavors)s"""
+
+
+def write_configs(path: Path, files: int) -> None:
+    for n in range(files):
+        sp = n % 6
+        flavors = "".join(FLAVOR % {"n": f, "sp": sp} for f in range(20))
+        text = CONFIG % {"n": n, "sp": sp, "flavors": flavors}
+        (path / f"{n:04}.yml").write_text(text)
+
+
+def main() -> None:
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp)
+        write_configs(path, files)
+        print(f"{files} metadata files")
+
+        results = []
+        for backend in ("ruamel", "libyaml"):
+            if backend == "libyaml" and not config.CSafeLoader:
+                print("PyYAML with libyaml not available")
+                continue
+            for parallel in (False, True):
+                config.configure(None, backend, 8 if parallel else 1)
+                start = perf_counter()
+                data = config._load_all(sorted(path.glob("*.yml")))
+                t = perf_counter() - start
+                results.append(data)
+                name = f"{backend}{', parallel' if parallel else ''}"
+                print(f"{name:>18}: {t:8.3f} s")
+
+        assert all(r == results[0] for r in results)
+
+
+if __name__ == "__main__":
+    main()
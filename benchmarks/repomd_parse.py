@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# Copyright SUSE LLC
+# SPDX-License-Identifier: MIT
+"""Compare full tree and streaming parse of large repomd.xml files
+
+Usage: python3 benchmarks/repomd_parse.py [number of data entries]
+"""
+
+import sys
+from pathlib import Path
+from timeit import timeit
+from xml.etree import ElementTree as ET
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from openqabot.loader.repohash import CHUNK_SIZE, REVISION_TAG, parse_revision
+
+DATA = """<data type="%(n)s"><checksum type="sha256">%(sum)s</checksum>\
+<location href="repodata/%(sum)s-%(n)s.xml.gz"/><timestamp>1666000000</timestamp>\
+<size>123456</size></data>"""
+
+
+def repomd(entries: int) -> bytes:
+    data = "".join(DATA % {"n": n, "sum": "%064x" % n} for n in range(entries))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+        'xmlns:rpm="http://linux.duke.edu/metadata/rpm">'
+        f"<revision>1666000000</revision>{data}</repomd>"
+    ).encode()
+
+
+def full(body: bytes) -> str:
+    return ET.fromstring(body.decode()).find(".//" + REVISION_TAG).text
+
+
+def streaming(body: bytes) -> str:
+    chunks = (body[i : i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE))
+    return parse_revision(chunks)
+
+
+def main() -> None:
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    body = repomd(entries)
+    assert full(body) == streaming(body)
+
+    number = 20
+    print(f"repomd.xml with {entries} data entries, {len(body)} bytes")
+    for name, func in (("full tree", full), ("streaming", streaming)):
+        t = timeit(lambda: func(body), number=number) / number
+        print(f"{name:>10}: {t * 1000:8.3f} ms per file")
+
+
+if __name__ == "__main__":
+    main()
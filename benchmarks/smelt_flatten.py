@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# Copyright SUSE LLC
+# SPDX-License-Identifier: MIT
+"""Compare walk() and flatten() of a large SMELT incident response
+
+Usage: python3 benchmarks/smelt_flatten.py [number of packages]
+"""
+
+import sys
+from copy import deepcopy
+from pathlib import Path
+from timeit import timeit
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from openqabot.utils import flatten, walk
+
+
+def edges(nodes):
+    return {"edges": [{"node": node} for node in nodes]}
+
+
+def incident(packages: int) -> dict:
+    return {
+        "emu": False,
+        "project": "SUSE:Maintenance:1000",
+        "repositories": edges(
+            {"name": f"SUSE:SLE-15-SP{n}:Update"} for n in range(packages // 2)
+        ),
+        "requestSet": edges(
+            {
+                "requestId": 1000 + n,
+                "status": {"name": "review"},
+                "reviewSet": edges(
+                    {
+                        "assignedByGroup": {"name": "qam-openqa"},
+                        "status": {"name": "new"},
+                    }
+                    for _ in range(20)
+                ),
+            }
+            for n in range(10)
+        ),
+        "packages": edges({"name": f"package-{n}"} for n in range(packages)),
+    }
+
+
+def main() -> None:
+    packages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    data = incident(packages)
+    assert walk(deepcopy(data)) == flatten(data)
+
+    number = 50
+    # walk() modifies its argument, copy for both to compare the same work
+    copies = [deepcopy(data) for _ in range(number)]
+    t_copy = timeit(lambda: deepcopy(data), number=number) / number
+    t_walk = timeit(lambda: walk(copies.pop()), number=number) / number
+    t_flatten = timeit(lambda: flatten(data), number=number) / number
+
+    print(f"incident with {packages} packages")
+    print(f"{'walk':>8}: {t_walk * 1000:8.3f} ms per incident")
+    print(f"{'flatten':>8}: {t_flatten * 1000:8.3f} ms per incident")
+    print(f"(deepcopy of input for walk: {t_copy * 1000:.3f} ms, not included)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# Copyright SUSE LLC
+# SPDX-License-Identifier: MIT
+"""Compare validation cost of SMELT incident responses
+
+Usage: python3 benchmarks/smelt_validate.py [number of packages]
+"""
+
+import sys
+from pathlib import Path
+from timeit import timeit
+
+from jsonschema import validate
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from openqabot.loader import smelt
+
+
+def edges(nodes):
+    return {"edges": [{"node": node} for node in nodes]}
+
+
+def incident(packages: int) -> dict:
+    node = {
+        "emu": False,
+        "project": "SUSE:Maintenance:1000",
+        "repositories": edges({"name": f"SUSE:SLE-15-SP{n}:Update"} for n in range(6)),
+        "requestSet": edges(
+            {
+                "requestId": 1000 + n,
+                "status": {"name": "review"},
+                "reviewSet": edges(
+                    {
+                        "assignedByGroup": {"name": "qam-openqa"},
+                        "status": {"name": "new"},
+                    }
+                    for _ in range(10)
+                ),
+            }
+            for n in range(3)
+        ),
+        "packages": edges({"name": f"package-{n}"} for n in range(packages)),
+    }
+    return {"data": {"incidents": edges([node])}}
+
+
+def every_call(data: dict) -> None:
+    validate(instance=data, schema=smelt.INCIDENT_SCHEMA)
+
+
+def precompiled(data: dict) -> None:
+    smelt.configure(fast_check=False)
+    smelt.validate_incident(data)
+
+
+def fast_check(data: dict) -> None:
+    smelt.configure(fast_check=True)
+    smelt.validate_incident(data)
+
+
+def main() -> None:
+    packages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    data = incident(packages)
+
+    number = 200
+    print(f"incident with {packages} packages")
+    for name, func in (
+        ("validate()", every_call),
+        ("precompiled", precompiled),
+        ("fast check", fast_check),
+    ):
+        t = timeit(lambda: func(data), number=number) / number
+        print(f"{name:>12}: {t * 1e6:10.1f} us per incident")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
 from argparse import Namespace
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 from logging import getLogger
 
 from .errors import EmptySettings
 from .loader.config import read_products
 from .loader.qem import get_aggregate_settings_data
 from .syncres import SyncRes
+from .utils import thread_pool
 
 log = getLogger("bot.aggrsync")
 
@@ -29,7 +30,7 @@ class AggregateResultsSync(SyncRes):
                 continue
 
         job_results = {}
-        with ThreadPoolExecutor() as executor:
+        with thread_pool() as executor:
             future_j = {
                 executor.submit(self.client.get_jobs, f): f for f in update_setting
             }
@@ -49,8 +50,7 @@ class AggregateResultsSync(SyncRes):
 
                 results.append(r)
 
-        for r in results:
-            self.post_result(r)
+        self.post_results(results)
 
         log.info("End of bot run")
 
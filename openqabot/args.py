@@ -70,6 +70,13 @@ def do_sync_aggregate_results(args):
     return syncer()
 
 
+def do_repohash_refresh(args):
+    from .repohashrefresh import RepoHashRefresh
+
+    refresh = RepoHashRefresh(args)
+    return refresh()
+
+
 def get_parser():
     parser = ArgumentParser(
         description="QEM-Dashboard, SMELT and openQA connector", prog="qem-bot"
@@ -113,6 +120,66 @@ def get_parser():
 
     parser.add_argument("-r", "--retry", type=int, default=2, help="Number of retries")
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=8,
+        help="Number of worker threads for concurrent requests",
+    )
+
+    parser.add_argument(
+        "--http-pool-size",
+        type=int,
+        help="Max connections per host, defaults to number of jobs",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path.home() / ".cache" / "qem-bot",
+        help="Directory for data cached between bot runs",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use data cached between bot runs",
+    )
+
+    parser.add_argument(
+        "--yaml-backend",
+        choices=("auto", "libyaml", "ruamel"),
+        default="auto",
+        help="Parser of metadata files, auto uses libyaml from PyYAML when available",
+    )
+
+    parser.add_argument(
+        "--yaml-jobs",
+        type=int,
+        default=1,
+        help="Worker processes parsing many uncached metadata files, limited to CPU count",
+    )
+
+    parser.add_argument(
+        "--head-check",
+        action="store_true",
+        help="Check cached repositories with HEAD before downloading repomd.xml",
+    )
+
+    parser.add_argument(
+        "--missing-ttl",
+        type=int,
+        default=600,
+        help="Seconds a missing repository is skipped without checking again",
+    )
+
+    parser.add_argument(
+        "--revisions-snapshot",
+        type=Path,
+        help="Load revisions of incidents from snapshot made by repohash-refresh",
+    )
+
     commands = parser.add_subparsers()
 
     cmdfull = commands.add_parser(
@@ -152,6 +219,66 @@ def get_parser():
     cmdsync = commands.add_parser(
         "smelt-sync", help="Sync data from SMELT into QEM Dashboard"
     )
+    cmdsync.add_argument(
+        "--delta",
+        action="store_true",
+        help="Send only incidents changed since last sync, needs cache",
+    )
+    cmdsync.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100,
+        help="Number of incidents sent together in --delta and --stream mode",
+    )
+    cmdsync.add_argument(
+        "--stream",
+        action="store_true",
+        help="Send incidents in chunks of --chunk-size while they are fetched",
+    )
+    cmdsync.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of incidents queried from SMELT in one request",
+    )
+    cmdsync.add_argument(
+        "--inline",
+        action="store_true",
+        help="Query active incidents with details in one paginated query",
+    )
+    cmdsync.add_argument(
+        "--page-size",
+        type=int,
+        default=100,
+        help="Number of incidents in one page of --inline query",
+    )
+    cmdsync.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Query SMELT only for incidents changed since last run, needs cache",
+    )
+    cmdsync.add_argument(
+        "--full-resync",
+        action="store_true",
+        help="Query all active incidents again in --incremental mode",
+    )
+    cmdsync.add_argument(
+        "--snapshot-max-age",
+        type=int,
+        default=86400,
+        help="Seconds after which --incremental queries all active incidents again",
+    )
+    cmdsync.add_argument(
+        "--smelt-rate",
+        type=float,
+        default=10.0,
+        help="Max number of requests per second to SMELT",
+    )
+    cmdsync.add_argument(
+        "--fast-check",
+        action="store_true",
+        help="Check only fields used by the bot instead of full SMELT schemas",
+    )
     cmdsync.set_defaults(func=do_sync_smelt)
 
     cmdappr = commands.add_parser(
@@ -180,11 +307,34 @@ def get_parser():
     cmdincsync = commands.add_parser(
         "inc-sync-results", help="Sync results of openQA incidents jobs to Dashboard"
     )
+    cmdincsync.add_argument(
+        "--force-full-sync",
+        action="store_true",
+        help="Post also results unchanged since last run",
+    )
     cmdincsync.set_defaults(func=do_sync_inc_results)
 
     cmdaggrsync = commands.add_parser(
         "aggr-sync-results", help="Sync results of openQA aggregates jobs to Dashboard"
     )
+    cmdaggrsync.add_argument(
+        "--force-full-sync",
+        action="store_true",
+        help="Post also results unchanged since last run",
+    )
     cmdaggrsync.set_defaults(func=do_sync_aggregate_results)
 
+    cmdrefresh = commands.add_parser(
+        "repohash-refresh",
+        help="Write snapshot with revisions of all incidents in Dashboard",
+    )
+    cmdrefresh.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=Path,
+        help="Snapshot file, used with --revisions-snapshot by other commands",
+    )
+    cmdrefresh.set_defaults(func=do_repohash_refresh)
+
     return parser
@@ -24,7 +24,7 @@ class Commenter:
         self.dry = args.dry
         self.token = {"Authorization": "Token {}".format(args.token)}
         self.client = openQAInterface(args)
-        self.incidents = get_incidents(self.token)
+        self.incidents = get_incidents(self.token, args.revisions_snapshot)
         osc.conf.get_config(override_apiurl=OBS_URL)
         self.commentapi = CommentAPI(OBS_URL)
 
@@ -3,11 +3,10 @@
 from argparse import Namespace
 import concurrent.futures as CT
 from logging import getLogger
-from typing import List
 
 from .loader.qem import get_active_incidents, get_incident_settings_data
 from .syncres import SyncRes
-from .types import Data
+from .utils import thread_pool
 
 log = getLogger("bot.incsyncres")
 
@@ -20,20 +19,25 @@ class IncResultsSync(SyncRes):
         self.active = get_active_incidents(self.token)
 
     def __call__(self) -> int:
-        incidents: List[Data] = []
-
-        for inc in self.active:
-            try:
-                incidents += get_incident_settings_data(self.token, inc)
-            except ValueError:
-                continue
-
         full = {}
 
-        with CT.ThreadPoolExecutor() as executor:
-            future_result = {
-                executor.submit(self.client.get_jobs, f): f for f in incidents
-            }
+        # separate pools for dashboard and openQA, so openQA queries start as
+        # soon as settings of an incident arrive instead of waiting behind
+        # the remaining settings requests
+        with thread_pool() as settings_executor, thread_pool() as executor:
+            future_settings = [
+                settings_executor.submit(get_incident_settings_data, self.token, inc)
+                for inc in self.active
+            ]
+            future_result = {}
+            for future in CT.as_completed(future_settings):
+                try:
+                    incidents = future.result()
+                except ValueError:
+                    continue
+                for f in incidents:
+                    future_result[executor.submit(self.client.get_jobs, f)] = f
+
             for future in CT.as_completed(future_result):
                 full[future_result[future]] = future.result()
 
@@ -50,8 +54,7 @@ class IncResultsSync(SyncRes):
 
                 results.append(r)
 
-        for r in results:
-            self.post_result(r)
+        self.post_results(results)
 
         log.info("End of bot run")
 
@@ -1,100 +1,374 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
+import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from itertools import repeat
 from logging import getLogger
 from pathlib import Path
-from typing import List, Set, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from ruamel.yaml import YAML  # type: ignore
+from ruamel.yaml.resolver import implicit_resolvers  # type: ignore
 
+try:
+    import yaml
+    from yaml import CSafeLoader
+except ImportError:
+    CSafeLoader = None
+
+from ..utils import dump_json, load_json
 from ..errors import NoTestIssues
-from ..types import Data
+from ..types import Data, Repos
 from ..types.aggregate import Aggregate
+from ..types.baseconf import BaseConf
+from ..types.incident import Incident
 from ..types.incidents import Incidents
 
 log = getLogger("bot.loader.config")
 
+MERGE_TAG = "tag:yaml.org,2002:merge"
 
-def load_metadata(
-    path: Path, aggregate: bool, incidents: bool, extrasettings: Set[str]
-) -> List[Union[Aggregate, Incidents]]:
-    ret: List[Union[Aggregate, Incidents]] = []
+# parsed metadata files between bot runs, see configure()
+CACHE_FILE = "metadata.json"
+# with --yaml-jobs files are parsed in worker processes only when there
+# are enough of them, libyaml is usually faster sequentially
+PARALLEL_MIN_FILES = 64
+
+_MISSING = object()
+RECORD_KEYS = {"sha256", "size", "mtime", "data"}
 
-    loader = YAML(typ="safe")
 
-    for p in path.glob("*.yml"):
+class MetadataCache:
+    """On-disk cache of parsed yaml files. An entry is reused while size
+    and mtime of the file are unchanged or while its content hash matches.
+    Data which doesn't survive a json round trip, like dates or non-string
+    keys, isn't cached."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.stats: Counter = Counter()
+        data = load_json(path, {})
+        self.data: Dict[str, Dict[str, Any]] = data if isinstance(data, dict) else {}
+
+    def get(self, p: Path) -> Any:
+        """Data of unchanged file or _MISSING"""
+        key = str(p.absolute())
+        stat = p.stat()
+        record = self.data.get(key)
+        if not isinstance(record, dict) or not RECORD_KEYS <= record.keys():
+            return _MISSING
+        if (record["size"], record["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+            if record["sha256"] != sha256(p.read_bytes()).hexdigest():
+                return _MISSING
+            record.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+            self.stats["updated"] += 1
+        self.stats["hits"] += 1
+        return record["data"]
+
+    def put(self, p: Path, data: Any) -> None:
+        self.stats["parsed"] += 1
         try:
-            data = loader.load(p)
-        except Exception as e:
-            log.exception(e)
-            continue
+            if json.loads(json.dumps(data)) != data:
+                return
+        except (TypeError, ValueError):
+            return
+        stat = p.stat()
+        self.data[str(p.absolute())] = {
+            "sha256": sha256(p.read_bytes()).hexdigest(),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "data": data,
+        }
+        self.stats["updated"] += 1
 
+    def save(self) -> None:
+        log.debug(
+            "Metadata cache: %s hits, %s parsed"
+            % (self.stats["hits"], self.stats["parsed"])
+        )
+        if not self.stats["updated"]:
+            return
+        self.data = {key: v for key, v in self.data.items() if Path(key).exists()}
         try:
-            settings = data.get("settings")
-        except AttributeError:
-            # not valid yaml for bot settings
-            continue
+            dump_json(self.path, self.data)
+        except OSError as e:
+            log.warning("Can't save metadata cache %s: %s" % (self.path, e))
+        self.stats.clear()
 
-        if "product" not in data:
-            log.debug("Skipping invalid config %s" % p)
-            continue
 
-        if settings:
-            for key in data:
-                if key == "incidents" and not incidents:
-                    ret.append(
-                        Incidents(data["product"], settings, data[key], extrasettings)
-                    )
-                elif key == "aggregate" and not aggregate:
-                    try:
-                        ret.append(Aggregate(data["product"], settings, data[key]))
-                    except NoTestIssues:
-                        log.warning("No 'test_issues' in %s config" % data["product"])
-                else:
-                    continue
-    return ret
+if CSafeLoader:
 
+    class _LibYAMLLoader(CSafeLoader):
+        """libyaml safe loader resolving and constructing scalars like
+        ruamel's YAML 1.2 safe loader, duplicate keys are errors"""
 
-def read_products(path: Path) -> List[Data]:
-    loader = YAML(typ="safe")
-    ret = []
+        yaml_implicit_resolvers: Dict[str, Any] = {}
 
-    for p in path.glob("*.yml"):
-        data = loader.load(p)
+        def construct_yaml_int(self, node):
+            value = self.construct_scalar(node).replace("_", "")
+            sign = -1 if value[0] == "-" else 1
+            value = value.lstrip("+-")
+            for prefix, base in (("0b", 2), ("0o", 8), ("0x", 16)):
+                if value.startswith(prefix):
+                    return sign * int(value[2:], base)
+            return sign * int(value)
 
-        if not data:
-            log.info("Skipping invalid config %s - empty config" % str(p))
-            continue
-        if not isinstance(data, dict):
-            log.info("Skipping invalid config %s - invalid format" % str(p))
-            continue
+        def construct_mapping(self, node, deep=False):
+            keys = [
+                key.value
+                for key, _ in node.value
+                if isinstance(key, yaml.ScalarNode) and key.tag != MERGE_TAG
+            ]
+            if len(keys) != len(set(keys)):
+                raise yaml.constructor.ConstructorError(
+                    None, None, "found duplicate key", node.start_mark
+                )
+            return super().construct_mapping(node, deep)
 
-        try:
-            flavor = data["aggregate"]["FLAVOR"]
-        except KeyError:
-            log.info("Config %s does not have aggregate" % str(p))
-            continue
+    for versions, tag, regexp, first in implicit_resolvers:
+        if (1, 2) in versions:
+            _LibYAMLLoader.add_implicit_resolver(tag, regexp, first)
+    _LibYAMLLoader.add_constructor(
+        "tag:yaml.org,2002:int", _LibYAMLLoader.construct_yaml_int
+    )
+
+_cache: Optional[MetadataCache] = None
+_backend = "libyaml" if CSafeLoader else "ruamel"
+_jobs = 1
 
+
+def configure(cache_dir: Optional[Path], backend: str = "auto", jobs: int = 1) -> None:
+    """Enable persistent metadata cache in cache_dir, None disables it.
+    Backend is libyaml, ruamel or auto which prefers libyaml. Files are
+    parsed in up to jobs worker processes, 1 parses them sequentially."""
+    global _cache, _backend, _jobs
+    _registries.clear()
+    _jobs = jobs
+    _cache = MetadataCache(cache_dir / CACHE_FILE) if cache_dir else None
+    if backend == "libyaml" and not CSafeLoader:
+        log.warning("PyYAML with libyaml is not available, using ruamel")
+    _backend = "libyaml" if backend != "ruamel" and CSafeLoader else "ruamel"
+
+
+def _parse(p: Path, backend: str) -> Tuple[bool, Any]:
+    """Parse yaml file, on failure the caller retries with ruamel to get
+    its result or exception"""
+    try:
+        if backend == "libyaml":
+            with p.open("rb") as f:
+                return True, yaml.load(f, Loader=_LibYAMLLoader)
+        return True, YAML(typ="safe").load(p)
+    except Exception:
+        return False, None
+
+
+def _load_all(paths: Iterable[Path]) -> List[Tuple[Path, Any]]:
+    """Load yaml files, unchanged ones from cache and the others in worker
+    processes when enabled and there are many of them. Data of a file which
+    failed to load is its exception."""
+    ret: Dict[Path, Any] = {}
+    for p in paths:
+        ret[p] = _cache.get(p) if _cache else _MISSING
+    todo = [p for p, data in ret.items() if data is _MISSING]
+
+    workers = min(_jobs, os.cpu_count() or 1)
+    if len(todo) >= PARALLEL_MIN_FILES and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(todo) // (4 * workers))
+            results = list(
+                executor.map(_parse, todo, repeat(_backend), chunksize=chunksize)
+            )
+    else:
+        results = [_parse(p, _backend) for p in todo]
+
+    for p, (ok, data) in zip(todo, results):
         try:
-            distri = data["settings"]["DISTRI"]
-            version = data["settings"]["VERSION"]
-            product = data["product"]
+            if not ok:
+                data = YAML(typ="safe").load(p)
         except Exception as e:
-            log.exception(e)
+            ret[p] = e
             continue
+        ret[p] = data
+        if _cache:
+            _cache.put(p, data)
 
-        for arch in data["aggregate"]["archs"]:
-            ret.append(Data(0, 0, flavor, arch, distri, version, "", product))
-
-    return ret
+    if _cache:
+        _cache.save()
+    return list(ret.items())
 
 
-def get_onearch(path: Path) -> Set[str]:
-    loader = YAML(typ="safe")
-
+def _singlearch(path: Path, files: Optional[Dict[Path, Any]] = None) -> Set[str]:
+    """Packages from singlearch file, parsed unless it is in files"""
     try:
-        data = loader.load(path)
+        data = files[path] if files and path in files else _load_all([path])[0][1]
+        if isinstance(data, Exception):
+            raise data
     except Exception as e:
         log.exception(e)
         return set()
 
     return set(data)
+
+
+class MetadataRegistry:
+    """Metadata directory parsed once per process. Products, incident and
+    aggregate configs, Data records and singlearch set are views on it."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._files: Optional[List[Tuple[Path, Any]]] = None
+
+    @property
+    def files(self) -> List[Tuple[Path, Any]]:
+        """Parsed yml files, data of a file which failed to load is its exception"""
+        if self._files is None:
+            self._files = _load_all(self.path.glob("*.yml"))
+        return self._files
+
+    def products(self) -> Dict[str, Dict[str, Any]]:
+        """Configs with settings by product"""
+        return {
+            data["product"]: data
+            for _, data in self.files
+            if isinstance(data, dict) and "product" in data and data.get("settings")
+        }
+
+    def configs(
+        self, aggregate: bool, incidents: bool, extrasettings: Set[str]
+    ) -> List[Union[Aggregate, Incidents]]:
+        """Incidents and Aggregate configs, disabled by aggregate/incidents"""
+        ret: List[Union[Aggregate, Incidents]] = []
+
+        for p, data in self.files:
+            if isinstance(data, Exception):
+                log.exception(data, exc_info=data)
+                continue
+
+            try:
+                settings = data.get("settings")
+            except AttributeError:
+                # not valid yaml for bot settings
+                continue
+
+            if "product" not in data:
+                log.debug("Skipping invalid config %s" % p)
+                continue
+
+            if settings:
+                for key in data:
+                    if key == "incidents" and not incidents:
+                        ret.append(
+                            Incidents(
+                                data["product"], settings, data[key], extrasettings
+                            )
+                        )
+                    elif key == "aggregate" and not aggregate:
+                        try:
+                            ret.append(Aggregate(data["product"], settings, data[key]))
+                        except NoTestIssues:
+                            log.warning(
+                                "No 'test_issues' in %s config" % data["product"]
+                            )
+                    else:
+                        continue
+        return ret
+
+    def incidents(self, extrasettings: Set[str]) -> List[Incidents]:
+        return self.configs(True, False, extrasettings)  # type: ignore
+
+    def aggregates(self) -> List[Aggregate]:
+        return self.configs(False, True, set())  # type: ignore
+
+    def data(self) -> List[Data]:
+        """Data records of all aggregate archs"""
+        ret = []
+
+        for p, data in self.files:
+            if isinstance(data, Exception):
+                raise data
+
+            if not data:
+                log.info("Skipping invalid config %s - empty config" % str(p))
+                continue
+            if not isinstance(data, dict):
+                log.info("Skipping invalid config %s - invalid format" % str(p))
+                continue
+
+            try:
+                flavor = data["aggregate"]["FLAVOR"]
+            except KeyError:
+                log.info("Config %s does not have aggregate" % str(p))
+                continue
+
+            try:
+                distri = data["settings"]["DISTRI"]
+                version = data["settings"]["VERSION"]
+                product = data["product"]
+            except Exception as e:
+                log.exception(e)
+                continue
+
+            for arch in data["aggregate"]["archs"]:
+                ret.append(Data(0, 0, flavor, arch, distri, version, "", product))
+
+        return ret
+
+    def singlearch(self, path: Path) -> Set[str]:
+        """Packages from singlearch file, taken from the directory when it
+        is in it"""
+        if path.parent != self.path:
+            return _singlearch(path)
+        return _singlearch(path, dict(self.files))
+
+
+class ChannelIndex:
+    """Inverted index from channel to (config, flavor, issue template)
+    entries which reference it"""
+
+    def __init__(self, configs: Iterable[BaseConf]) -> None:
+        self.entries: Dict[Repos, List[Tuple[BaseConf, str, str]]] = defaultdict(list)
+        for config in configs:
+            for repo, flavor, issue in config.channels():
+                self.entries[repo].append((config, flavor, issue))
+
+    def get(self, repo: Repos) -> List[Tuple[BaseConf, str, str]]:
+        return self.entries.get(repo, [])
+
+    def match(self, incidents: Iterable[Incident]) -> Dict[BaseConf, List[Incident]]:
+        """Incidents with a channel in each config, in the given order"""
+        ret: Dict[BaseConf, List[Incident]] = defaultdict(list)
+        for inc in incidents:
+            configs = {entry[0] for repo in inc.channels for entry in self.get(repo)}
+            for config in configs:
+                ret[config].append(inc)
+        return ret
+
+
+_registries: Dict[Path, MetadataRegistry] = {}
+
+
+def registry(path: Path) -> MetadataRegistry:
+    """Shared registry of metadata directory"""
+    if path not in _registries:
+        _registries[path] = MetadataRegistry(path)
+    return _registries[path]
+
+
+def load_metadata(
+    path: Path, aggregate: bool, incidents: bool, extrasettings: Set[str]
+) -> List[Union[Aggregate, Incidents]]:
+    return registry(path).configs(aggregate, incidents, extrasettings)
+
+
+def read_products(path: Path) -> List[Data]:
+    return registry(path).data()
+
+
+def get_onearch(path: Path) -> Set[str]:
+    # don't parse the whole directory of a standalone singlearch file
+    if path.parent in _registries:
+        return _registries[path.parent].singlearch(path)
+    return _singlearch(path)
@@ -1,9 +1,15 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
+import concurrent.futures as CT
+from collections import Counter
 from logging import getLogger
 from operator import itemgetter
+from pathlib import Path
 from pprint import pformat
-from typing import Dict, List, NamedTuple, Sequence
+from threading import Lock
+from time import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+from urllib.parse import urlencode
 
 import requests as req
 
@@ -15,8 +21,10 @@ from ..errors import (
     NoRepoFoundError,
     NoResultsError,
 )
-from ..types import Data
+from ..types import ArchVer, Data
 from ..types.incident import Incident
+from . import repohash
+from ..utils import dump_json, load_json, thread_pool
 from ..utils import retry5 as requests
 
 log = getLogger("bot.loader.qem")
@@ -33,17 +41,83 @@ class JobAggr(NamedTuple):
     withAggregate: bool
 
 
-def get_incidents(token: Dict[str, str]) -> List[Incident]:
-    incidents = requests.get(QEM_DASHBOARD + "api/incidents", headers=token).json()
+class DashboardCache:
+    """Run-scoped cache of QEM Dashboard GET responses, concurrent requests
+    for the same resource share one fetch. Returned data must not be modified."""
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.data: Dict[str, CT.Future] = {}
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+
+    @staticmethod
+    def endpoint(api: str) -> str:
+        return "/".join(p for p in api.split("/") if not p.isdigit())
+
+    def get(self, api: str, token: Dict[str, str], params=None) -> Any:
+        key = f"{api}?{urlencode(params)}" if params else api
+        with self.lock:
+            future = self.data.get(key)
+            owner = future is None
+            if owner:
+                future = self.data[key] = CT.Future()
+                self.misses[self.endpoint(api)] += 1
+            else:
+                self.hits[self.endpoint(api)] += 1
+
+        if not owner:
+            return future.result()
 
-    xs = []
-    for i in incidents:
         try:
-            xs.append(Incident(i))
-        except NoRepoFoundError as e:
+            data = requests.get(
+                QEM_DASHBOARD + api, headers=token, params=params
+            ).json()
+        except Exception as e:
+            with self.lock:
+                del self.data[key]
+            future.set_exception(e)
+            raise e
+
+        future.set_result(data)
+        return data
+
+    def invalidate(self, api: str) -> None:
+        """Drop all cached resources under api, used after our own writes"""
+        with self.lock:
+            for key in [k for k in self.data if k.startswith(api)]:
+                del self.data[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def log_stats(self) -> None:
+        for endpoint in sorted(self.misses):
             log.info(
-                "Project %s can't calculate repohash %s .. skipping" % (i["project"], e)
+                "Dashboard cache %s: %s hits, %s misses"
+                % (endpoint, self.hits[endpoint], self.misses[endpoint])
             )
+
+
+dashboard = DashboardCache()
+
+
+def get_json(api: str, token: Dict[str, str], params=None) -> Any:
+    return dashboard.get(api, token, params)
+
+
+def get_incidents(
+    token: Dict[str, str], snapshot: Optional[Path] = None, resolve: bool = True
+) -> List[Incident]:
+    incidents = get_json("api/incidents", token)
+
+    xs = []
+    for i in incidents:
+        try:
+            xs.append(Incident(i, resolve=False))
         except EmptyChannels as e:
             log.info(
                 "Project %s has empty channels - check incident in SMELT" % i["project"]
@@ -53,12 +127,98 @@ def get_incidents(token: Dict[str, str]) -> List[Incident]:
                 "Project %s has empty packages - check incident in SMELT" % i["project"]
             )
 
+    if not resolve:
+        return xs
+
+    if snapshot:
+        xs = load_revisions_snapshot(snapshot, xs)
+    else:
+        xs = resolve_revisions(xs)
+    repohash.save_cache()
+    log.info(
+        "Revisions resolved for %s incidents, %s known missing repositories skipped, "
+        "%s repositories unchanged by HEAD check"
+        % (len(xs), repohash.stats["negative_hits"], repohash.stats["head_hits"])
+    )
+
     return xs
 
 
+def resolve_revisions(incidents: List[Incident]) -> List[Incident]:
+    """Resolve revisions of all incidents with one pool over all their
+    repositories, incidents without repository are skipped"""
+
+    results = repohash.get_revisions_many(
+        [(inc.revision_repos(), inc.project) for inc in incidents]
+    )
+
+    xs = []
+    for inc, result in zip(incidents, results):
+        if isinstance(result, NoRepoFoundError):
+            log.info(
+                "Project %s can't calculate repohash %s .. skipping"
+                % (inc.project, result)
+            )
+        else:
+            inc.revisions = result
+            xs.append(inc)
+
+    return xs
+
+
+def write_revisions_snapshot(
+    path: Path, incidents: List[Incident], resolved: List[Incident]
+) -> None:
+    """Store revisions of resolved incidents, the others are stored as None"""
+    ok = set(inc.id for inc in resolved)
+    data = {
+        str(inc.id): (
+            [[k.arch, k.version, v] for k, v in inc.revisions.items()]
+            if inc.id in ok
+            else None
+        )
+        for inc in incidents
+    }
+    dump_json(path, {"created": time(), "incidents": data})
+
+
+def load_revisions_snapshot(path: Path, incidents: List[Incident]) -> List[Incident]:
+    """Apply revisions from snapshot, incidents missing in the snapshot
+    are resolved from download server"""
+
+    snapshot = load_json(path, {})
+    created = snapshot.get("created") if isinstance(snapshot, dict) else None
+    if not isinstance(created, (int, float)) or "incidents" not in snapshot:
+        log.warning("Invalid revisions snapshot %s, using download server" % path)
+        return resolve_revisions(incidents)
+
+    log.info(
+        "Using revisions snapshot %s created %d seconds ago" % (path, time() - created)
+    )
+    revisions = snapshot["incidents"]
+
+    unknown = [inc for inc in incidents if str(inc.id) not in revisions]
+    if unknown:
+        log.info("%s incidents not in revisions snapshot" % len(unknown))
+    ok = set(inc.id for inc in resolve_revisions(unknown))
+
+    for inc in incidents:
+        revs = revisions.get(str(inc.id))
+        if revs:
+            inc.revisions = {ArchVer(a, v): rev for a, v, rev in revs}
+            ok.add(inc.id)
+        elif str(inc.id) in revisions:
+            log.info(
+                "Project %s has no repohash in revisions snapshot .. skipping"
+                % inc.project
+            )
+
+    return [inc for inc in incidents if inc.id in ok]
+
+
 def get_active_incidents(token: Dict[str, str]) -> Sequence[int]:
     try:
-        data = requests.get(QEM_DASHBOARD + "api/incidents", headers=token).json()
+        data = get_json("api/incidents", token)
     except Exception as e:
         log.exception(e)
         raise e
@@ -66,21 +226,19 @@ def get_active_incidents(token: Dict[str, str]) -> Sequence[int]:
 
 
 def get_incidents_approver(token: Dict[str, str]) -> List[IncReq]:
-    incidents = requests.get(QEM_DASHBOARD + "api/incidents", headers=token).json()
+    incidents = get_json("api/incidents", token)
     return [IncReq(i["number"], i["rr_number"]) for i in incidents if i["inReviewQAM"]]
 
 
 def get_single_incident(token: Dict[str, str], id: int) -> List[IncReq]:
-    incident = requests.get(QEM_DASHBOARD + "api/incidents/" + id, headers=token).json()
+    incident = get_json("api/incidents/" + id, token)
     return [IncReq(incident["number"], incident["rr_number"])]
 
 
 def get_incident_settings(
     inc: int, token: Dict[str, str], all_incidents: bool = False
 ) -> List[JobAggr]:
-    settings = requests.get(
-        QEM_DASHBOARD + "api/incident_settings/" + str(inc), headers=token
-    ).json()
+    settings = get_json("api/incident_settings/" + str(inc), token)
     if not settings:
         raise NoResultsError("Inc %s does not have any job_settings" % str(inc))
 
@@ -95,10 +253,9 @@ def get_incident_settings(
 
 
 def get_incident_settings_data(token: Dict[str, str], number: int) -> Sequence[Data]:
-    url = QEM_DASHBOARD + "api/incident_settings/" + f"{number}"
     log.info("Getting settings for %s" % number)
     try:
-        data = requests.get(url, headers=token).json()
+        data = get_json("api/incident_settings/" + f"{number}", token)
     except Exception as e:
         log.exception(e)
         raise e
@@ -133,9 +290,7 @@ def get_incident_results(inc: int, token: Dict[str, str]):
     ret = []
     for job_aggr in settings:
         try:
-            data = requests.get(
-                QEM_DASHBOARD + "api/jobs/incident/" + f"{job_aggr.id}", headers=token
-            ).json()
+            data = get_json("api/jobs/incident/" + f"{job_aggr.id}", token)
             ret += data
         except Exception as e:
             log.exception(e)
@@ -147,9 +302,7 @@ def get_incident_results(inc: int, token: Dict[str, str]):
 
 
 def get_aggregate_settings(inc: int, token: Dict[str, str]) -> List[JobAggr]:
-    settings = requests.get(
-        QEM_DASHBOARD + "api/update_settings/" + str(inc), headers=token
-    ).json()
+    settings = get_json("api/update_settings/" + str(inc), token)
     if not settings:
         raise NoResultsError("Inc %s does not have any aggregates settings" % str(inc))
 
@@ -162,13 +315,12 @@ def get_aggregate_settings(inc: int, token: Dict[str, str]) -> List[JobAggr]:
 
 
 def get_aggregate_settings_data(token: Dict[str, str], data: Data):
-    url = (
-        QEM_DASHBOARD
-        + "api/update_settings"
-        + f"?product={data.product}&arch={data.arch}"
-    )
     try:
-        settings = requests.get(url, headers=token).json()
+        settings = get_json(
+            "api/update_settings",
+            token,
+            params={"product": data.product, "arch": data.arch},
+        )
     except Exception as e:
         log.exception(e)
         raise e
@@ -208,9 +360,7 @@ def get_aggregate_results(inc: int, token: Dict[str, str]):
     ret = []
     for job_aggr in settings:
         try:
-            data = requests.get(
-                QEM_DASHBOARD + "api/jobs/update/" + f"{job_aggr.id}", headers=token
-            ).json()
+            data = get_json("api/jobs/update/" + f"{job_aggr.id}", token)
         except Exception as e:
             log.exception(e)
             raise e
@@ -228,6 +378,7 @@ def update_incidents(token: Dict[str, str], data, **kwargs) -> int:
         retry -= 1
         try:
             ret = req.patch(QEM_DASHBOARD + "api/incidents", headers=token, json=data)
+            dashboard.invalidate("api/incidents")
         except Exception as e:
             log.exception(e)
             return 1
@@ -244,14 +395,55 @@ def update_incidents(token: Dict[str, str], data, **kwargs) -> int:
     return 2
 
 
-def post_job(token: Dict[str, str], data) -> None:
+def _update_incident(token: Dict[str, str], inc) -> bool:
+    try:
+        ret = req.patch(
+            QEM_DASHBOARD + f"api/incidents/{inc['number']}",
+            headers=token,
+            json=inc,
+        )
+    except Exception as e:
+        log.exception(e)
+        return False
+    if ret.status_code != 200:
+        log.error(
+            "Smelt Incident %s was not synced to dashboard: error %s"
+            % (inc["number"], ret.status_code)
+        )
+        return False
+    return True
+
+
+def update_incidents_chunk(token: Dict[str, str], data, **kwargs) -> int:
+    """Update given incidents concurrently one request each, failed ones
+    are retried"""
+    retry = kwargs.get("retry", 0)
+    pending = data
+    while pending and retry >= 0:
+        retry -= 1
+        with thread_pool() as executor:
+            results = list(
+                executor.map(lambda inc: _update_incident(token, inc), pending)
+            )
+        pending = [inc for inc, ok in zip(pending, results) if not ok]
+
+    dashboard.invalidate("api/incidents")
+    return 2 if pending else 0
+
+
+def post_job(token: Dict[str, str], data) -> Optional[str]:
+    """Returns error message, None on success"""
     try:
         result = requests.put(QEM_DASHBOARD + "api/jobs", headers=token, json=data)
+        dashboard.invalidate("api/jobs")
         if result.status_code != 200:
-            log.error(result.text)
+            return result.text
 
     except Exception as e:
         log.exception(e)
+        return str(e)
+
+    return None
 
 
 def update_job(token: Dict[str, str], job_id: int, data) -> None:
@@ -259,6 +451,7 @@ def update_job(token: Dict[str, str], job_id: int, data) -> None:
         result = requests.patch(
             QEM_DASHBOARD + "api/jobs/" + str(job_id), headers=token, json=data
         )
+        dashboard.invalidate("api/jobs")
         if result.status_code != 200:
             log.error(result.text)
 
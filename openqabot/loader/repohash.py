@@ -1,64 +1,375 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
-from datetime import datetime
+import concurrent.futures as CT
+from collections import Counter
 from hashlib import md5
 from logging import getLogger
-from typing import List, Tuple
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from xml.etree import ElementTree as ET
 
 from requests import ConnectionError, HTTPError
-from requests.exceptions import RetryError
+from requests.exceptions import ChunkedEncodingError, RetryError
 
 from ..errors import NoRepoFoundError
-from ..utils import retry5 as requests
+from ..types import ArchVer
+from ..utils import dump_json, load_json, thread_pool
+from ..utils import retry5_fail_fast as requests
 
 log = getLogger("bot.loader.repohash")
 
+REVISION_TAG = "{http://linux.duke.edu/metadata/repo}revision"
+CHUNK_SIZE = 4096
 
-def get_max_revision(
-    repos: List[Tuple[str, str]],
-    arch: str,
-    project: str,
-) -> int:
-    max_rev = 0
+# process-wide single-flight cache: url -> Future with revision or NoRepoFoundError
+_revisions: Dict[str, CT.Future] = {}
+_revisions_lock = Lock()
 
-    url_base = f"http://download.suse.de/ibs/{project.replace(':',':/')}"
+# counters for the run summary
+stats: Counter = Counter()
+
+# persistent cache of revisions between bot runs, see configure()
+CACHE_FILE = "repohash.json"
+CACHE_MAX_AGE = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 20000
+# how long is a missing repository remembered, shorter than one bot cycle
+# so a repository published meanwhile is found by the next run
+CACHE_MISSING_TTL = 600
+
+
+class RevisionCache:
+    """On-disk cache of repomd.xml revisions with http validators"""
+
+    def __init__(
+        self,
+        path: Path,
+        max_age: int = CACHE_MAX_AGE,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        missing_ttl: int = CACHE_MISSING_TTL,
+        head_check: bool = False,
+    ) -> None:
+        self.path = path
+        self.head_check = head_check
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.missing_ttl = missing_ttl
+        self.lock = Lock()
+        self.data: Dict[str, Dict[str, Any]] = load_json(path, {})
 
-    for repo in repos:
-        # openSUSE and SLE incidents have different handling of architecture
-        if repo[0].startswith("openSUSE"):
-            url = f"{url_base}/SUSE_Updates_{repo[0]}_{repo[1]}/repodata/repomd.xml"
-        else:
-            url = f"{url_base}/SUSE_Updates_{repo[0]}_{repo[1]}_{arch}/repodata/repomd.xml"
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.data.get(url)
 
+    def put(self, url: str, headers, revision: int) -> None:
+        record = {"revision": revision, "checked": time()}
+        if "ETag" in headers:
+            record["etag"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            record["last_modified"] = headers["Last-Modified"]
+        if "Content-Length" in headers:
+            record["content_length"] = headers["Content-Length"]
+        with self.lock:
+            self.data[url] = record
+
+    def put_missing(self, url: str) -> None:
+        with self.lock:
+            self.data[url] = {"missing": True, "checked": time()}
+
+    def is_missing(self, url: str) -> bool:
+        """Known missing repository, valid for missing_ttl seconds"""
+        with self.lock:
+            record = self.data.get(url)
+        return bool(
+            record
+            and record.get("missing")
+            and record["checked"] > time() - self.missing_ttl
+        )
+
+    def touch(self, url: str) -> None:
+        with self.lock:
+            self.data[url]["checked"] = time()
+
+    def evict(self) -> None:
+        deadline = time() - self.max_age
+        with self.lock:
+            records = sorted(
+                (
+                    (url, record)
+                    for url, record in self.data.items()
+                    if record["checked"] > deadline
+                ),
+                key=lambda x: x[1]["checked"],
+                reverse=True,
+            )
+            self.data = dict(records[: self.max_entries])
+
+    def save(self) -> None:
+        self.evict()
         try:
-            root = ET.fromstring(requests.get(url).text)
-            cs = root.find(".//{http://linux.duke.edu/metadata/repo}revision")
-        except (
-            ET.ParseError,
-            ConnectionError,
-            HTTPError,
-            RetryError,
-        ):  # for now, use logger.exception to determine possible exceptions in this code :D
-            log.info("%s not found -- skip incident" % url)
+            with self.lock:
+                dump_json(self.path, self.data)
+        except OSError as e:
+            log.warning("Can't save revision cache %s: %s" % (self.path, e))
+
+
+_cache: Optional[RevisionCache] = None
+
+
+def configure(cache_dir: Optional[Path], **kwargs) -> None:
+    """Enable persistent revision cache in cache_dir, None disables it"""
+    global _cache
+    _cache = RevisionCache(cache_dir / CACHE_FILE, **kwargs) if cache_dir else None
+
+
+def save_cache() -> None:
+    if _cache:
+        _cache.save()
+
+
+def _repomd_url(repo: Tuple[str, str], arch: str, project: str) -> str:
+    url_base = f"http://download.suse.de/ibs/{project.replace(':',':/')}"
+
+    # openSUSE and SLE incidents have different handling of architecture
+    if repo[0].startswith("openSUSE"):
+        return f"{url_base}/SUSE_Updates_{repo[0]}_{repo[1]}/repodata/repomd.xml"
+    return f"{url_base}/SUSE_Updates_{repo[0]}_{repo[1]}_{arch}/repodata/repomd.xml"
+
+
+def _conditional_headers(record: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    headers = {}
+    if record:
+        if "etag" in record:
+            headers["If-None-Match"] = record["etag"]
+        if "last_modified" in record:
+            headers["If-Modified-Since"] = record["last_modified"]
+    return headers
+
+
+def parse_revision(chunks: Iterable[bytes]) -> Optional[str]:
+    """Incrementally parse repomd.xml and stop reading at the revision element"""
+    parser = ET.XMLPullParser(events=("end",))
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            if elem.tag == REVISION_TAG:
+                return elem.text
+    parser.close()
+    return None
+
+
+def _count(key: str) -> None:
+    with _revisions_lock:
+        stats[key] += 1
+
+
+def _unchanged(url: str, record: Dict[str, Any]) -> bool:
+    """HEAD pre-check against Last-Modified and Content-Length of the record,
+    Last-Modified is required and any HEAD error means changed"""
+    if "last_modified" not in record:
+        return False
+    validators = [
+        (header, record[key])
+        for header, key in (
+            ("Last-Modified", "last_modified"),
+            ("Content-Length", "content_length"),
+        )
+        if key in record
+    ]
+
+    try:
+        res = requests.head(url)
+    except (ConnectionError, HTTPError, RetryError) as e:
+        log.debug("HEAD %s failed: %s" % (url, e))
+        return False
+    if res.status_code != 200:
+        return False
+    return all(res.headers.get(header) == value for header, value in validators)
+
+
+def _fetch_revision(url: str) -> int:
+    record = None
+    if _cache:
+        if _cache.is_missing(url):
+            _count("negative_hits")
+            log.info("%s known missing -- skip incident" % url)
+            raise NoRepoFoundError
+        record = _cache.get(url)
+        if record and "revision" not in record:
+            record = None
+
+    try:
+        if record and _cache.head_check and _unchanged(url, record):
+            _count("head_hits")
+            log.debug("%s unchanged since last check" % url)
+            _cache.touch(url)
+            return record["revision"]
+        with requests.get(
+            url, headers=_conditional_headers(record), stream=True
+        ) as res:
+            if record and res.status_code == 304:
+                log.debug("%s not modified" % url)
+                _cache.touch(url)
+                return record["revision"]
+            if res.status_code == 404 and _cache:
+                _cache.put_missing(url)
+            res.raise_for_status()
+            cs = parse_revision(res.iter_content(CHUNK_SIZE))
+    except (
+        ET.ParseError,
+        ChunkedEncodingError,
+        ConnectionError,
+        HTTPError,
+        RetryError,
+    ):  # for now, use logger.exception to determine possible exceptions in this code :D
+        log.info("%s not found -- skip incident" % url)
+        raise NoRepoFoundError
+    except Exception as e:
+        log.exception(e)
+        raise e
+
+    if cs is None:
+        log.error("%s's revision is None" % url)
+        raise NoRepoFoundError
+
+    rev = int(cs)
+    if _cache:
+        _cache.put(url, res.headers, rev)
+
+    return rev
+
+
+def _get_revision(url: str) -> int:
+    """Concurrent or repeated requests for the same url share one fetch"""
+
+    with _revisions_lock:
+        future = _revisions.get(url)
+        owner = future is None
+        if owner:
+            future = _revisions[url] = CT.Future()
+
+    if not owner:
+        return future.result()
+
+    try:
+        rev = _fetch_revision(url)
+    except NoRepoFoundError as e:
+        future.set_exception(e)
+        raise e
+    except Exception as e:
+        # unexpected errors are not cached, next caller will try again
+        with _revisions_lock:
+            del _revisions[url]
+        future.set_exception(e)
+        raise e
+
+    future.set_result(rev)
+    return rev
+
+
+def clear_cache() -> None:
+    with _revisions_lock:
+        _revisions.clear()
+        stats.clear()
+
+
+K = TypeVar("K", bound=Hashable)
+
+
+def _reduce(futures: Dict[K, List[CT.Future]]) -> Dict[K, int]:
+    """Max revision per key, the first failing url in order is raised"""
+    ret: Dict[K, int] = {}
+    for key, lfutures in futures.items():
+        max_rev = max((f.result() for f in lfutures), default=0)
+        if max_rev == 0:
             raise NoRepoFoundError
+        ret[key] = max_rev
+    return ret
+
+
+def _max_revisions(
+    urls: Dict[Hashable, List[str]], max_workers: Optional[int] = None
+) -> Dict[Hashable, int]:
+    """Fetch all given repomd.xml files concurrently and reduce them to
+    the max revision per key. The first failing url in order is raised."""
+
+    with thread_pool(max_workers) as executor:
+        futures = {
+            key: [executor.submit(_get_revision, url) for url in lurls]
+            for key, lurls in urls.items()
+        }
+        try:
+            return _reduce(futures)
         except Exception as e:
-            log.exception(e)
+            executor.shutdown(wait=True, cancel_futures=True)
             raise e
 
-        if cs is None:
-            log.error("%s's revision is None" % url)
-            raise NoRepoFoundError
 
-        rev = int(str(cs.text))
+def _revision_urls(
+    repos: Dict[ArchVer, List[Tuple[str, str]]], project: str
+) -> Dict[ArchVer, List[str]]:
+    return {
+        archver: [_repomd_url(repo, archver.arch, project) for repo in lrepos]
+        for archver, lrepos in repos.items()
+    }
 
-        if rev > max_rev:
-            max_rev = rev
 
-    if max_rev == 0:
-        raise NoRepoFoundError
+def get_max_revision(
+    repos: List[Tuple[str, str]],
+    arch: str,
+    project: str,
+    max_workers: Optional[int] = None,
+) -> int:
+    urls = [_repomd_url(repo, arch, project) for repo in repos]
+    return _max_revisions({arch: urls}, max_workers)[arch]
+
+
+def get_revisions(
+    repos: Dict[ArchVer, List[Tuple[str, str]]],
+    project: str,
+    max_workers: Optional[int] = None,
+) -> Dict[ArchVer, int]:
+    """Resolve max revision for every ArchVer group of one incident
+    in a single wave of concurrent requests"""
+
+    return _max_revisions(_revision_urls(repos, project), max_workers)
 
-    return max_rev
+
+def get_revisions_many(
+    pairs: List[Tuple[Dict[ArchVer, List[Tuple[str, str]]], str]],
+    max_workers: Optional[int] = None,
+) -> List[Union[Dict[ArchVer, int], NoRepoFoundError]]:
+    """Resolve revisions of several (repos, project) pairs with one pool
+    over all their urls. A pair without repository gives NoRepoFoundError
+    instead of its revisions, other errors are raised."""
+
+    with thread_pool(max_workers) as executor:
+        futures = [
+            {
+                archver: [executor.submit(_get_revision, url) for url in lurls]
+                for archver, lurls in _revision_urls(repos, project).items()
+            }
+            for repos, project in pairs
+        ]
+
+    ret: List[Union[Dict[ArchVer, int], NoRepoFoundError]] = []
+    for lfutures in futures:
+        try:
+            ret.append(_reduce(lfutures))
+        except NoRepoFoundError as e:
+            ret.append(e)
+    return ret
 
 
 def merge_repohash(hashes: List[str]) -> str:
@@ -2,15 +2,17 @@
 # SPDX-License-Identifier: MIT
 import concurrent.futures as CT
 from logging import getLogger
-from typing import Any, List, Set
-from jsonschema import validate, ValidationError
+from time import monotonic, sleep
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+from jsonschema import ValidationError
+from jsonschema.validators import validator_for
 
 import urllib3
 import urllib3.exceptions
 
-from .. import SMELT
-from ..utils import walk
-from ..utils import retry10 as requests
+from .. import SMELT, utils
+from ..utils import Throttle, flatten, thread_pool
+from ..utils import retry10_throttled as requests
 
 log = getLogger("bot.loader.smelt")
 
@@ -22,10 +24,51 @@ ACTIVE_FST = '{ incidents(status_Name_Iexact:"active", first: 100 ) { pageInfo \
 ACTIVE_NEXT = '{ incidents(status_Name_Iexact:"active", first: 100, \
 after: "%(cursor)s" ) { pageInfo { hasNextPage endCursor} edges { node { incidentId}}}}'
 
-INCIDENT = '{incidents(incidentId: %(incident)s) { edges { node {emu project \
-repositories { edges { node { name } } } requestSet(kind: "RR") { edges { node \
-{ requestId status { name } reviewSet { edges { node { assignedByGroup { name } \
-status { name } } } } } } } packages { edges { node { name } } } } } } }'
+INCIDENT_FIELDS = 'emu project repositories { edges { node { name } } } \
+requestSet(kind: "RR") { edges { node { requestId status { name } reviewSet \
+{ edges { node { assignedByGroup { name } status { name } } } } } } } \
+packages { edges { node { name } } }'
+
+INCIDENT_NODE = "{ edges { node {" + INCIDENT_FIELDS + "} } }"
+
+INCIDENT = "{incidents(incidentId: %(incident)s) " + INCIDENT_NODE + " }"
+
+# one aliased selection per incident, joined into single query
+INCIDENT_ALIAS = "i%(incident)s: incidents(incidentId: %(incident)s) " + INCIDENT_NODE
+
+# active incidents with all details, %(after)s is empty or ', after: "cursor"'
+ACTIVE_DETAILS = (
+    '{ incidents(status_Name_Iexact:"active", first: %(first)s%(after)s ) \
+{ pageInfo { hasNextPage endCursor} edges { node { incidentId '
+    + INCIDENT_FIELDS
+    + "}}}}"
+)
+
+# incidents of any status modified since %(since)s, the status tells
+# whether an incident is still active
+CHANGED = (
+    '{ incidents(modified_Gte: "%(since)s", first: %(first)s%(after)s ) \
+{ pageInfo { hasNextPage endCursor} edges { node { incidentId status { name } '
+    + INCIDENT_FIELDS
+    + "}}}}"
+)
+
+# incidents whose release request or one of its reviews was modified since
+# %(since)s, these changes don't update modification time of the incident
+CHANGED_REQUESTS = (
+    '{ requests(kind: "RR", modified_Gte: "%(since)s", first: %(first)s%(after)s ) \
+{ pageInfo { hasNextPage endCursor} edges { node { incident { incidentId status { name } '
+    + INCIDENT_FIELDS
+    + "}}}}}"
+)
+
+CHANGED_REVIEWS = (
+    '{ reviews(modified_Gte: "%(since)s", first: %(first)s%(after)s ) \
+{ pageInfo { hasNextPage endCursor} edges { node { request { incident { incidentId '
+    + "status { name } "
+    + INCIDENT_FIELDS
+    + "}}}}}}"
+)
 
 ACTIVE_INC_SCHEMA = {
     "type": "object",
@@ -84,26 +127,37 @@ INCIDENT_SCHEMA = {
                         "edges": {
                             "type": "array",
                             "items": {
-                                "node": {
-                                    "type": "object",
-                                    "properties": {
-                                        "emu": {
-                                            "type": "boolean",
-                                        },
-                                        "project": {
-                                            "type": "string",
-                                        },
-                                        "repositories": {
-                                            "type": "object",
-                                        },
-                                        "packages": {
-                                            "type": "object",
-                                        },
-                                        "requestSet": {
-                                            "type": "object",
+                                "type": "object",
+                                "properties": {
+                                    "node": {
+                                        "type": "object",
+                                        "properties": {
+                                            "emu": {
+                                                "type": "boolean",
+                                            },
+                                            "project": {
+                                                "type": "string",
+                                            },
+                                            "repositories": {
+                                                "type": "object",
+                                            },
+                                            "packages": {
+                                                "type": "object",
+                                            },
+                                            "requestSet": {
+                                                "type": "object",
+                                            },
                                         },
+                                        "required": [
+                                            "emu",
+                                            "project",
+                                            "repositories",
+                                            "packages",
+                                            "requestSet",
+                                        ],
                                     },
                                 },
+                                "required": ["node"],
                             },
                         },
                     },
@@ -117,14 +171,140 @@ INCIDENT_SCHEMA = {
 }
 
 
-def get_json(query: str, host: str = SMELT) -> dict:
+def _validator(schema: dict):
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+# schemas are checked and validators built only once
+_active_validator = _validator(ACTIVE_INC_SCHEMA)
+_incident_validator = _validator(INCIDENT_SCHEMA)
+
+# check only fields used by the bot instead of full schemas, see configure()
+_fast_check = False
+
+
+# requests per second to SMELT, concurrency adapts to its responses
+RATE = 10.0
+RETRIES = 10
+BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+_throttle = Throttle(RATE, burst=int(RATE))
+
+
+def configure(fast_check: bool = False, rate: float = RATE) -> None:
+    global _fast_check, _throttle
+    _fast_check = fast_check
+    _throttle = Throttle(rate, burst=max(1, int(rate)))
+
+
+def _check_active(data: dict) -> None:
+    try:
+        incidents = data["data"]["incidents"]
+        page = incidents["pageInfo"]
+        ok = (
+            isinstance(page["hasNextPage"], bool)
+            and isinstance(page["endCursor"], str)
+            and isinstance(incidents["edges"], list)
+            and all(
+                isinstance(x["node"]["incidentId"], int) for x in incidents["edges"]
+            )
+        )
+    except (KeyError, TypeError):
+        ok = False
+    if not ok:
+        raise ValidationError("Unexpected structure of active incidents")
+
+
+def _check_incident(data: dict) -> None:
+    try:
+        node = data["data"]["incidents"]["edges"][0]["node"]
+        ok = (
+            isinstance(node["emu"], bool)
+            and isinstance(node["project"], str)
+            and all(
+                isinstance(node[key], dict)
+                for key in ("repositories", "packages", "requestSet")
+            )
+        )
+    except (IndexError, KeyError, TypeError):
+        ok = False
+    if not ok:
+        raise ValidationError("Unexpected structure of incident")
+
+
+def validate_active(data: dict) -> None:
+    if _fast_check:
+        _check_active(data)
+    else:
+        _active_validator.validate(data)
+
+
+def validate_incident(data: dict) -> None:
+    if _fast_check:
+        _check_incident(data)
+    else:
+        _incident_validator.validate(data)
+
+
+def _backoff(res, attempt: int) -> float:
+    try:
+        return min(float(res.headers["Retry-After"]), MAX_BACKOFF)
+    except (KeyError, ValueError):
+        return min(BACKOFF * 2**attempt, MAX_BACKOFF)
+
+
+def get_json(query: str, host: str = SMELT, post: bool = False) -> dict:
+    """Query SMELT GraphQL api, large queries should be sent with post=True
+    as JSON body instead of URL query string"""
     try:
-        return requests.get(host, params={"query": query}, verify=False).json()
+        for attempt in range(RETRIES):
+            _throttle.acquire()
+            start = monotonic()
+            try:
+                if post:
+                    res = requests.post(host, json={"query": query}, verify=False)
+                else:
+                    res = requests.get(host, params={"query": query}, verify=False)
+            except Exception as e:
+                _throttle.release(monotonic() - start, overloaded=True)
+                raise e
+            overloaded = res.status_code == 429 or res.status_code >= 500
+            _throttle.release(monotonic() - start, overloaded)
+            if not overloaded:
+                break
+            delay = _backoff(res, attempt)
+            log.warning("SMELT returned %s, retry in %.1fs" % (res.status_code, delay))
+            sleep(delay)
+        res.raise_for_status()
+        return res.json()
     except Exception as e:
         log.exception(e)
         raise e
 
 
+def log_stats() -> None:
+    stats = _throttle.stats
+    if not stats["requests"]:
+        return
+    latencies = sorted(_throttle.latencies)
+    log.info(
+        "SMELT requests: %s, overloaded: %s, throttled: %s, latency avg %.3fs, "
+        "p95 %.3fs, max %.3fs, concurrency limit %s"
+        % (
+            stats["requests"],
+            stats["overloaded"],
+            stats["throttled"],
+            sum(latencies) / len(latencies),
+            latencies[int(len(latencies) * 0.95)],
+            latencies[-1],
+            int(_throttle.limit),
+        )
+    )
+
+
 def get_active_incidents() -> Set[int]:
     """Get active incidents from SMELT GraphQL api"""
 
@@ -137,7 +317,7 @@ def get_active_incidents() -> Set[int]:
         query = ACTIVE_NEXT % {"cursor": cursor} if cursor else ACTIVE_FST
         ndata = get_json(query)
         try:
-            validate(instance=ndata, schema=ACTIVE_INC_SCHEMA)
+            validate_active(ndata)
         except ValidationError as e:
             log.exception("Invalid data from SMELT received")
             return []
@@ -152,14 +332,10 @@ def get_active_incidents() -> Set[int]:
     return active
 
 
-def get_incident(incident: int):
-    query = INCIDENT % {"incident": incident}
-
-    log.info("Getting info about incident %s from SMELT" % incident)
-    inc_result = get_json(query)
+def _parse_incident(incident: int, inc_result):
     try:
-        validate(instance=inc_result, schema=INCIDENT_SCHEMA)
-        inc_result = walk(inc_result["data"]["incidents"]["edges"][0]["node"])
+        validate_incident(inc_result)
+        inc_result = flatten(inc_result["data"]["incidents"]["edges"][0]["node"])
     except ValidationError as e:
         log.exception("Invalid data from SMELT for incident %s" % incident)
         return None
@@ -171,14 +347,150 @@ def get_incident(incident: int):
     return inc_result
 
 
-def get_incidents(active: Set[int]) -> List[Any]:
-    incidents = []
+def _parse_node(edge: Any):
+    """Validate and flatten one incident of paginated query like
+    _parse_incident, invalid incident returns None"""
+    try:
+        incident = edge["node"]["incidentId"]
+    except (KeyError, TypeError):
+        log.error("Invalid data from SMELT, incident without incidentId")
+        return None
+    return _parse_incident(incident, {"data": {"incidents": {"edges": [edge]}}})
+
+
+def _page(data: dict, root: str, path: Tuple[str, ...]) -> dict:
+    """Page of paginated query over root with each node replaced by the
+    incident found under path in it, nodes without incident are dropped"""
+    try:
+        page = data["data"][root]
+        edges = page["edges"]
+        for key in path:
+            edges = [{"node": e["node"][key]} for e in edges if e["node"][key]]
+        return {"pageInfo": page["pageInfo"], "edges": edges}
+    except (KeyError, TypeError):
+        raise ValidationError("Unexpected structure of %s" % root)
+
+
+def _iter_pages(
+    query: str,
+    params: Dict[str, Any],
+    what: str,
+    root: str = "incidents",
+    path: Tuple[str, ...] = (),
+) -> Iterator[Any]:
+    """Yield flattened incidents of paginated query as pages arrive,
+    invalid incidents are logged and skipped, invalid page is logged
+    and raises ValidationError"""
+
+    count = 0
+    skipped = 0
+    has_next = True
+    after = ""
+
+    while has_next:
+        log.info("Getting page of %s incidents with details from SMELT" % what)
+        ndata = get_json(query % dict(params, after=after))
+        try:
+            incidents = _page(ndata, root, path)
+            validate_active({"data": {"incidents": incidents}})
+        except ValidationError as e:
+            log.exception("Invalid data from SMELT received")
+            raise e
+        for edge in incidents["edges"]:
+            inc = _parse_node(edge)
+            if inc is None:
+                skipped += 1
+                continue
+            count += 1
+            yield inc
+        has_next = incidents["pageInfo"]["hasNextPage"]
+        if has_next:
+            after = ', after: "%s"' % incidents["pageInfo"]["endCursor"]
+
+    log.info("Loaded %s %s incidents, %s invalid skipped" % (count, what, skipped))
+
+
+def iter_active_incidents(page_size: int = 100, strict: bool = False) -> Iterator[Any]:
+    """Get active incidents with details in one paginated query,
+    pages are yielded as they arrive. Invalid data ends the iteration
+    or raises ValidationError when strict."""
+    try:
+        yield from _iter_pages(ACTIVE_DETAILS, {"first": page_size}, "active")
+    except ValidationError as e:
+        if strict:
+            raise e
+
+
+def iter_changed_incidents(since: str, page_size: int = 100) -> Iterator[Any]:
+    """Get incidents of any status modified since given ISO timestamp,
+    including incidents whose release request or its reviews were modified.
+    An incident can be yielded more than once, invalid data raises
+    ValidationError."""
+    params = {"since": since, "first": page_size}
+    yield from _iter_pages(CHANGED, params, "changed")
+    yield from _iter_pages(
+        CHANGED_REQUESTS, params, "request changed", "requests", ("incident",)
+    )
+    yield from _iter_pages(
+        CHANGED_REVIEWS, params, "review changed", "reviews", ("request", "incident")
+    )
+
+
+def get_incident(incident: int):
+    query = INCIDENT % {"incident": incident}
+
+    log.info("Getting info about incident %s from SMELT" % incident)
+    return _parse_incident(incident, get_json(query))
+
+
+def get_incident_batch(incidents: List[int]) -> List[Any]:
+    """Get info about several incidents with one aliased query"""
+    query = (
+        "{" + " ".join(INCIDENT_ALIAS % {"incident": inc} for inc in incidents) + "}"
+    )
+
+    log.info(
+        "Getting info about incidents %s from SMELT"
+        % ", ".join(str(inc) for inc in incidents)
+    )
+    # aliased query grows with batch size, don't put it in the URL
+    result = get_json(query, post=True)
+    data = result.get("data") or {}
+
+    return [
+        _parse_incident(inc, {"data": {"incidents": data.get(f"i{inc}")}})
+        for inc in incidents
+    ]
+
+
+def iter_incidents(active: Iterable[int], batch_size: int = 1) -> Iterator[Any]:
+    """Yield incidents as their queries complete. At most two queries per
+    worker are in flight or waiting to be consumed, so results don't pile
+    up when the consumer is slower than SMELT."""
+
+    active = list(active)
+    if batch_size > 1:
+        fetch = get_incident_batch
+        batches = [
+            active[i : i + batch_size] for i in range(0, len(active), batch_size)
+        ]
+    else:
+        fetch = lambda inc: [get_incident(inc)]
+        batches = active
+
+    with thread_pool() as executor:
+        window = 2 * utils.JOBS
+        pending: Set[CT.Future] = set()
+        for batch in batches:
+            if len(pending) >= window:
+                done, pending = CT.wait(pending, return_when=CT.FIRST_COMPLETED)
+                for future in done:
+                    yield from (inc for inc in future.result() if inc)
+            pending.add(executor.submit(fetch, batch))
 
-    with CT.ThreadPoolExecutor() as executor:
-        future_inc = [executor.submit(get_incident, inc) for inc in active]
+        for future in CT.as_completed(pending):
+            yield from (inc for inc in future.result() if inc)
 
-        for future in CT.as_completed(future_inc):
-            incidents.append(future.result())
 
-    incidents = [inc for inc in incidents if inc]
-    return incidents
+def get_incidents(active: Set[int], batch_size: int = 1) -> List[Any]:
+    return list(iter_incidents(active, batch_size))
@@ -4,6 +4,9 @@ import logging
 import sys
 
 from .args import get_parser
+from .loader import config, repohash, smelt
+from .loader.qem import dashboard
+from .utils import configure_http
 
 
 def create_logger() -> logging.Logger:
@@ -40,4 +43,17 @@ def main() -> None:
     if cfg.debug:
         log.setLevel(logging.DEBUG)
 
-    sys.exit(cfg.func(cfg))
+    configure_http(cfg.jobs, cfg.http_pool_size)
+
+    if not cfg.no_cache:
+        repohash.configure(
+            cfg.cache_dir, head_check=cfg.head_check, missing_ttl=cfg.missing_ttl
+        )
+    config.configure(
+        None if cfg.no_cache else cfg.cache_dir, cfg.yaml_backend, cfg.yaml_jobs
+    )
+
+    ret = cfg.func(cfg)
+    dashboard.log_stats()
+    smelt.log_stats()
+    sys.exit(ret)
@@ -6,8 +6,8 @@ from os import environ
 
 from . import QEM_DASHBOARD
 from .errors import PostOpenQAError
-from .loader.config import get_onearch, load_metadata
-from .loader.qem import get_incidents
+from .loader.config import ChannelIndex, registry
+from .loader.qem import dashboard, get_incidents
 from .openqa import openQAInterface
 from .utils import retry3 as requests
 
@@ -20,14 +20,17 @@ class OpenQABot:
         self.dry = args.dry
         self.ignore_onetime = args.ignore_onetime
         self.token = {"Authorization": "Token " + args.token}
-        self.incidents = get_incidents(self.token)
+        self.incidents = get_incidents(self.token, args.revisions_snapshot)
         log.info("%s incidents loaded from qem dashboard" % len(self.incidents))
 
-        extrasettings = get_onearch(args.singlearch)
+        # singlearch file in metadata directory is parsed with it only once
+        meta = registry(args.configs)
+        extrasettings = meta.singlearch(args.singlearch)
 
-        self.workers = load_metadata(
-            args.configs, args.disable_aggregates, args.disable_incidents, extrasettings
+        self.workers = meta.configs(
+            args.disable_aggregates, args.disable_incidents, extrasettings
         )
+        self.index = ChannelIndex(self.workers)
 
         self.openqa = openQAInterface(args)
         self.ci = environ.get("CI_JOB_URL")
@@ -43,6 +46,7 @@ class OpenQABot:
         url = QEM_DASHBOARD + api
         try:
             res = requests.put(url, headers=self.token, json=data)
+            dashboard.invalidate(api)
             log.info(
                 "Put to dashboard result %s, database id: %s"
                 % (res.status_code, res.json().get("id", "No id?"))
@@ -57,8 +61,13 @@ class OpenQABot:
     def __call__(self):
         log.info("Starting bot mainloop")
         post = []
+        # every worker gets only incidents with a channel it references, but
+        # is called even without them as aggregates are scheduled regardless
+        matched = self.index.match(self.incidents)
         for worker in self.workers:
-            post += worker(self.incidents, self.token, self.ci, self.ignore_onetime)
+            post += worker(
+                matched.get(worker, []), self.token, self.ci, self.ignore_onetime
+            )
 
         if self.dry:
             log.info("Would trigger %s products in openQA" % len(post))
@@ -0,0 +1,31 @@
+# Copyright SUSE LLC
+# SPDX-License-Identifier: MIT
+from argparse import Namespace
+from logging import getLogger
+from typing import Dict
+
+from .loader import repohash
+from .loader.qem import get_incidents, resolve_revisions, write_revisions_snapshot
+
+log = getLogger("bot.repohashrefresh")
+
+
+class RepoHashRefresh:
+    def __init__(self, args: Namespace) -> None:
+        self.token: Dict[str, str] = {"Authorization": "Token " + args.token}
+        self.output = args.output
+
+    def __call__(self) -> int:
+        log.info("Start resolving revisions of incidents")
+
+        incidents = get_incidents(self.token, resolve=False)
+        resolved = resolve_revisions(incidents)
+        repohash.save_cache()
+
+        write_revisions_snapshot(self.output, incidents, resolved)
+        log.info(
+            "Revisions of %s incidents written to %s, %s incidents without repository"
+            % (len(resolved), self.output, len(incidents) - len(resolved))
+        )
+
+        return 0
@@ -1,37 +1,241 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
 from argparse import Namespace
-from logging import getLogger
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from logging import DEBUG, getLogger
 from operator import itemgetter
+from pathlib import Path
 from pprint import pformat
-from typing import Any, Dict, List
+from time import time
+from typing import Any, Dict, Iterable, List, Optional
 
-from .loader.qem import update_incidents
-from .loader.smelt import get_active_incidents, get_incidents
+from jsonschema import ValidationError
+from requests import RequestException
+
+from .loader.qem import get_json, update_incidents, update_incidents_chunk
+from .loader.smelt import configure as configure_smelt
+from .loader.smelt import (
+    get_active_incidents,
+    iter_active_incidents,
+    iter_changed_incidents,
+    iter_incidents,
+)
+from .utils import dump_json, load_json
 
 log = getLogger("bot.smeltsync")
 
+# last successfully synced records for --delta, in --cache-dir
+STATE_FILE = "smelt-sync.json"
+
+# snapshot of active SMELT incidents for --incremental, in --cache-dir
+SNAPSHOT_FILE = "smelt-snapshot.json"
+# changes are queried with overlap to tolerate clock skew to SMELT
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# full resync picks up changes which modified neither the incident nor its
+# release request or reviews
+SNAPSHOT_MAX_AGE = 86400
+
 
 class SMELTSync:
     def __init__(self, args: Namespace) -> None:
         self.dry: bool = args.dry
         self.token: Dict[str, str] = {"Authorization": "Token " + args.token}
-        self.incidents = get_incidents(get_active_incidents())
+        configure_smelt(args.fast_check, args.smelt_rate)
+        if args.incremental and not args.no_cache:
+            self.incidents: Optional[Iterable[Any]] = self._load_incremental(
+                args.cache_dir / SNAPSHOT_FILE,
+                args.full_resync,
+                args.page_size,
+                args.snapshot_max_age,
+            )
+        elif args.inline:
+            # lazy, pages are fetched while records are created, invalid
+            # page raises so that incidents of later pages aren't dropped
+            self.incidents = iter_active_incidents(args.page_size, strict=True)
+        else:
+            # lazy, incidents are processed as their queries complete
+            self.incidents = iter_incidents(get_active_incidents(), args.batch_size)
         self.retry = args.retry
+        self.delta: bool = args.delta and not args.no_cache
+        self.chunk_size: int = args.chunk_size
+        self.stream: bool = args.stream
+        self.state_file = args.cache_dir / STATE_FILE if self.delta else None
 
     def __call__(self) -> int:
         log.info("Start syncing incidents from smelt to dashboard")
+        if self.incidents is None:
+            log.error("No valid data from SMELT, nothing synced")
+            return 1
 
-        data = self._create_list(self.incidents)
+        if self.stream:
+            if not (self.dry or self.delta):
+                return self._sync_stream()
+            log.warning("--stream is ignored with --dry or --delta")
+
+        try:
+            data = self._create_list(self.incidents)
+        except ValidationError:
+            log.error("No valid data from SMELT, nothing synced")
+            return 1
         log.info("Updating info about %s incidents" % str(len(data)))
-        log.info("Data: %s" % pformat(data))
+        self._log_data(data)
 
-        if not self.dry:
-            ret = update_incidents(self.token, data, retry=self.retry)
-        else:
+        if self.dry:
             log.info("Dry run, nothing synced")
             ret = 0
+        elif self.delta:
+            ret = self._sync_delta(data)
+        else:
+            ret = update_incidents(self.token, data, retry=self.retry)
+
+        return ret
+
+    @staticmethod
+    def _load_incremental(
+        path: Path,
+        full_resync: bool,
+        page_size: int,
+        max_age: int = SNAPSHOT_MAX_AGE,
+    ) -> Optional[List[Any]]:
+        """Merge incidents changed since last run into snapshot of active
+        incidents. Without snapshot, with full_resync, with snapshot older
+        than max_age seconds or when the query of changes fails get all
+        of them."""
+        snapshot = None if full_resync else load_json(path)
+        watermark = datetime.now(timezone.utc)
+
+        if snapshot is not None and time() - snapshot.get("created", 0) > max_age:
+            log.info("SMELT snapshot older than %ss, full resync" % max_age)
+            snapshot = None
+
+        incidents = None
+        if snapshot is not None:
+            try:
+                incidents = snapshot["incidents"]
+                since = datetime.fromisoformat(snapshot["watermark"])
+                changed = iter_changed_incidents(
+                    (since - WATERMARK_OVERLAP).isoformat(), page_size
+                )
+                for inc in changed:
+                    if inc["status"]["name"].lower() == "active":
+                        incidents[str(inc["incidentId"])] = inc
+                    else:
+                        incidents.pop(str(inc["incidentId"]), None)
+                created = snapshot["created"]
+            except (KeyError, RequestException, ValidationError, ValueError) as e:
+                log.warning("Query of changed incidents failed, full resync: %s" % e)
+                incidents = None
+
+        if incidents is None:
+            log.info("Loading all active incidents into SMELT snapshot")
+            try:
+                incidents = {
+                    str(inc["incidentId"]): inc
+                    for inc in iter_active_incidents(page_size, strict=True)
+                }
+            except ValidationError:
+                return None
+            created = time()
+
+        try:
+            dump_json(
+                path,
+                {
+                    "watermark": watermark.isoformat(),
+                    "created": created,
+                    "incidents": incidents,
+                },
+            )
+        except OSError as e:
+            log.warning("Can't save SMELT snapshot %s: %s" % (path, e))
+
+        return list(incidents.values())
+
+    @staticmethod
+    def _log_data(data: List[Dict[str, Any]]) -> None:
+        if log.isEnabledFor(DEBUG):
+            log.debug("Data: %s" % pformat(data))
+
+    def _sync_stream(self) -> int:
+        """Send records in chunks as incidents arrive from SMELT, incidents
+        of a chunk are updated concurrently. Afterwards deactivate incidents
+        which are active only in dashboard"""
+        records = (self._create_record(inc) for inc in self.incidents)
+        synced = set()
+        ret = 0
+
+        try:
+            while chunk := list(islice(records, self.chunk_size)):
+                log.info("Updating info about %s incidents" % len(chunk))
+                self._log_data(chunk)
+                if update_incidents_chunk(self.token, chunk, retry=self.retry):
+                    ret = 2
+                synced.update(inc["number"] for inc in chunk)
+        except ValidationError:
+            log.error("No valid data from SMELT, no incidents removed")
+            return 1
+
+        removed = [
+            dict(inc, isActive=False)
+            for inc in get_json("api/incidents", self.token)
+            if inc["number"] not in synced
+        ]
+        log.info("Synced %s incidents, %s removed" % (len(synced), len(removed)))
+        for i in range(0, len(removed), self.chunk_size):
+            chunk = removed[i : i + self.chunk_size]
+            if update_incidents_chunk(self.token, chunk, retry=self.retry):
+                ret = 2
+
+        if ret == 0:
+            log.info("Smelt Incidents updated")
+        return ret
+
+    def _save_state(self, state: Dict[str, Dict[str, Any]]) -> None:
+        try:
+            dump_json(self.state_file, state)
+        except OSError as e:
+            log.warning("Can't save sync state %s: %s" % (self.state_file, e))
+
+    def _sync_delta(self, data: List[Dict[str, Any]]) -> int:
+        """Send only incidents changed or removed since last successful sync"""
+        new = {str(inc["number"]): inc for inc in data}
+        state = load_json(self.state_file)
+
+        if state is None:
+            log.info("No previous sync state, syncing all incidents")
+            ret = update_incidents(self.token, data, retry=self.retry)
+            if ret == 0:
+                self._save_state(new)
+            return ret
+
+        changed = [inc for number, inc in new.items() if state.get(number) != inc]
+        removed = [
+            dict(inc, isActive=False)
+            for number, inc in state.items()
+            if number not in new
+        ]
+        log.info(
+            "Delta sync: %s changed and %s removed incidents"
+            % (len(changed), len(removed))
+        )
+
+        ret = 0
+        pending = changed + removed
+        for i in range(0, len(pending), self.chunk_size):
+            chunk = pending[i : i + self.chunk_size]
+            if update_incidents_chunk(self.token, chunk, retry=self.retry):
+                ret = 2
+                continue
+            for inc in chunk:
+                if str(inc["number"]) in new:
+                    state[str(inc["number"])] = inc
+                else:
+                    del state[str(inc["number"])]
+            self._save_state(state)
 
+        if ret == 0:
+            log.info("Smelt Incidents updated")
         return ret
 
     @staticmethod
@@ -120,5 +324,5 @@ class SMELTSync:
         return incident
 
     @classmethod
-    def _create_list(cls, incidents: List[Any]) -> List[Dict[str, Any]]:
+    def _create_list(cls, incidents: Iterable[Any]) -> List[Dict[str, Any]]:
         return [cls._create_record(inc) for inc in incidents]
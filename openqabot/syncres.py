@@ -1,18 +1,25 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
 
+import json
 from argparse import Namespace
+from collections import Counter
+from hashlib import md5
 from logging import getLogger
 from pprint import pformat
-from typing import Dict
+from threading import Lock
+from typing import Any, Dict, List, Optional
 
 from .loader.qem import post_job
 from .openqa import openQAInterface
 from .types import Data
-from .utils import normalize_results
+from .utils import dump_json, load_json, normalize_results, thread_pool
 
 log = getLogger("bot.syncres")
 
+# digests of last posted results per job id, in --cache-dir
+RESULTS_FILE = "%s-results.json"
+
 
 class SyncRes:
     operation = "null"
@@ -21,6 +28,13 @@ class SyncRes:
         self.dry: bool = args.dry
         self.token: Dict[str, str] = {"Authorization": f"Token {args.token}"}
         self.client = openQAInterface(args)
+        self.retry: int = args.retry
+        self.stats: Counter = Counter()
+        self.stats_lock = Lock()
+        self.force: bool = args.force_full_sync
+        self.digest_file = (
+            None if args.no_cache else args.cache_dir / (RESULTS_FILE % self.operation)
+        )
 
     @classmethod
     def normalize_data(cls, data: Data, job):
@@ -70,7 +84,23 @@ class SyncRes:
 
         return True
 
-    def post_result(self, result):
+    def _count(self, key: str) -> None:
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _post(self, result) -> Optional[str]:
+        for attempt in range(self.retry + 1):
+            if attempt:
+                self._count("retried")
+            error = post_job(self.token, result)
+            if error is None:
+                self._count("posted")
+                return None
+        self._count("failed")
+        return error
+
+    def post_result(self, result) -> Optional[str]:
+        """Returns error message, None on success"""
         log.debug(
             "Posting results of %s job %s with status %s"
             % (self.operation, result["job_id"], result["status"])
@@ -78,6 +108,54 @@ class SyncRes:
         log.debug("Full post data: %s" % pformat(result))
 
         if not self.dry and self.client:
-            post_job(self.token, result)
-        else:
-            log.info("Dry run -- data in dashboard untouched")
+            return self._post(result)
+
+        log.info("Dry run -- data in dashboard untouched")
+        return None
+
+    @staticmethod
+    def digest(result: Dict[str, Any]) -> str:
+        return md5(json.dumps(result, sort_keys=True).encode()).hexdigest()
+
+    def post_results(self, results: List[Dict[str, Any]]) -> None:
+        """Post results concurrently, errors are reported in order of results.
+        Results unchanged since last run are not posted again."""
+        posting = not self.dry and self.client
+        last = {}
+        if posting and self.digest_file and not self.force:
+            last = load_json(self.digest_file, {})
+
+        digests = {}
+        pending = []
+        for result in results:
+            digest = self.digest(result)
+            if last.get(str(result["job_id"])) == digest:
+                self.stats["suppressed"] += 1
+                digests[str(result["job_id"])] = digest
+            else:
+                pending.append((result, digest))
+
+        with thread_pool() as executor:
+            errors = list(executor.map(self.post_result, (r for r, _ in pending)))
+
+        for (result, digest), error in zip(pending, errors):
+            if error:
+                log.error("Posting job %s failed: %s" % (result["job_id"], error))
+            else:
+                digests[str(result["job_id"])] = digest
+
+        if posting:
+            log.info(
+                "Results posted: %s, failed: %s, retried: %s, unchanged: %s"
+                % (
+                    self.stats["posted"],
+                    self.stats["failed"],
+                    self.stats["retried"],
+                    self.stats["suppressed"],
+                )
+            )
+            if self.digest_file:
+                try:
+                    dump_json(self.digest_file, digests)
+                except OSError as e:
+                    log.warning("Can't save %s: %s" % (self.digest_file, e))
@@ -4,18 +4,18 @@ from collections import defaultdict
 from datetime import date
 from itertools import chain
 from logging import getLogger
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from . import ProdVer, Repos
-from .. import DOWNLOAD_BASE, QEM_DASHBOARD
+from .. import DOWNLOAD_BASE
 from ..errors import NoTestIssues, SameBuildExists
+from ..loader.qem import get_json
 from ..loader.repohash import merge_repohash
 from ..pc_helper import (
     apply_pc_tools_image,
     apply_publiccloud_pint_image,
     apply_publiccloud_regex,
 )
-from ..utils import retry3 as requests
 from .baseconf import BaseConf
 from .incident import Incident
 
@@ -46,6 +46,13 @@ class Aggregate(BaseConf):
     def __repr__(self):
         return f"<Aggregate product: {self.product}>"
 
+    def channels(self) -> Iterator[Tuple[Repos, str, str]]:
+        for arch in self.archs:
+            issues_arch = self.settings.get("TEST_ISSUES_ARCH", arch)
+            for issue, template in self.test_issues.items():
+                repo = Repos(template.product, template.version, issues_arch)
+                yield repo, self.flavor, issue
+
     @staticmethod
     def get_buildnr(repohash: str, old_repohash: str, build: str) -> str:
         today = date.today().strftime("%Y%m%d")
@@ -114,11 +121,11 @@ class Aggregate(BaseConf):
             )
 
             try:
-                old_jobs = requests.get(
-                    QEM_DASHBOARD + "api/update_settings",
+                old_jobs = get_json(
+                    "api/update_settings",
+                    token,
                     params={"product": self.product, "arch": arch},
-                    headers=token,
-                ).json()
+                )
             except Exception as e:
                 log.exception(e)
                 old_jobs = None
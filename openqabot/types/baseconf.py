@@ -1,8 +1,9 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
 from abc import ABCMeta, abstractmethod, abstractstaticmethod
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from . import Repos
 from .incident import Incident
 
 
@@ -24,3 +25,8 @@ class BaseConf(metaclass=ABCMeta):
     @abstractstaticmethod
     def normalize_repos(config):
         pass
+
+    @abstractmethod
+    def channels(self) -> Iterator[Tuple[Repos, str, str]]:
+        """Channels referenced by config with their flavor and issue template"""
+        pass
@@ -5,15 +5,15 @@ from logging import getLogger
 from typing import Dict, List, Tuple
 
 from . import ArchVer, Repos
-from ..errors import EmptyChannels, EmptyPackagesError, NoRepoFoundError
-from ..loader.repohash import get_max_revision
+from ..errors import EmptyChannels, EmptyPackagesError
+from ..loader.repohash import get_revisions
 
 log = getLogger("bot.types.incident")
 version_pattern = re.compile(r"(\d+(?:[.-](?:SP)?\d+)?)")
 
 
 class Incident:
-    def __init__(self, incident):
+    def __init__(self, incident, resolve: bool = True):
         self.rr = incident["rr_number"]
         self.project = incident["project"]
         self.id = incident["number"]
@@ -67,12 +67,22 @@ class Incident:
             raise EmptyPackagesError(self.project)
 
         self.emu = incident["emu"]
-        self.revisions = self._rev(self.channels, self.project)
+        self.revisions: Dict[ArchVer, int] = {}
         self.livepatch: bool = self._is_livepatch(self.packages)
 
+        if resolve:
+            self.resolve_revisions()
+
+    def resolve_revisions(self) -> None:
+        """Network part of the construction, can be deferred with resolve=False"""
+        self.revisions = self._rev(self.channels, self.project)
+
+    def revision_repos(self) -> Dict[ArchVer, List[Tuple[str, str]]]:
+        """Repositories of the incident grouped by their revision key"""
+        return self._group_repos(self.channels)
+
     @staticmethod
-    def _rev(channels: List[Repos], project: str) -> Dict[ArchVer, int]:
-        rev: Dict[ArchVer, int] = {}
+    def _group_repos(channels: List[Repos]) -> Dict[ArchVer, List[Tuple[str, str]]]:
         tmpdict: Dict[ArchVer, List[Tuple[str, str]]] = {}
 
         for repo in channels:
@@ -88,14 +98,15 @@ class Incident:
             else:
                 tmpdict[ArchVer(repo.arch, version)] = [(repo.product, repo.version)]
 
+        return tmpdict
+
+    @staticmethod
+    def _rev(channels: List[Repos], project: str) -> Dict[ArchVer, int]:
+        rev: Dict[ArchVer, int] = {}
+        tmpdict = Incident._group_repos(channels)
+
         if tmpdict:
-            for archver, lrepos in tmpdict.items():
-                try:
-                    max_rev = get_max_revision(lrepos, archver.arch, project)
-                    if max_rev > 0:
-                        rev[archver] = max_rev
-                except NoRepoFoundError as e:
-                    raise e
+            rev = get_revisions(tmpdict, project)
 
         return rev
 
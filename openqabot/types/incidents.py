@@ -1,16 +1,15 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
 from logging import getLogger
-from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 from . import ArchVer, ProdVer, Repos
-from .. import QEM_DASHBOARD
 from ..pc_helper import (
     apply_pc_tools_image,
     apply_publiccloud_pint_image,
     apply_publiccloud_regex,
 )
-from ..utils import retry3 as requests
+from ..loader.qem import get_json
 from .baseconf import BaseConf
 from .incident import Incident
 
@@ -42,6 +41,12 @@ class Incidents(BaseConf):
 
         return ret
 
+    def channels(self) -> Iterator[Tuple[Repos, str, str]]:
+        for flavor, data in self.flavors.items():
+            for arch in data["archs"]:
+                for issue, channel in data.get("issues", {}).items():
+                    yield Repos(channel.product, channel.version, arch), flavor, issue
+
     @staticmethod
     def _repo_osuse(chan: Repos) -> Union[Repos, Tuple[str, str]]:
         if chan.product == "openSUSE-SLE":
@@ -54,10 +59,7 @@ class Incidents(BaseConf):
     ) -> bool:
         jobs = {}
         try:
-            jobs = requests.get(
-                f"{QEM_DASHBOARD}api/incident_settings/{inc.id}",
-                headers=token,
-            ).json()
+            jobs = get_json(f"api/incident_settings/{inc.id}", token)
         except Exception as e:
             log.exception(e)
 
@@ -1,7 +1,15 @@
 # Copyright SUSE LLC
 # SPDX-License-Identifier: MIT
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from typing import Optional
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Condition
+from time import monotonic, sleep
+from typing import Any, FrozenSet, List, Optional, Tuple
 
 from requests import Session
 from requests.adapters import HTTPAdapter
@@ -26,6 +34,37 @@ def walk(inc):
     return inc
 
 
+def flatten(data: Any) -> Any:
+    """Same result as walk() built iteratively in one pass, shares only
+    scalar values with data which is left unchanged"""
+
+    def unwrap(value: Any) -> Any:
+        while isinstance(value, dict) and len(value) == 1 and "edges" in value:
+            value = value["edges"]
+        if isinstance(value, dict) and len(value) == 1 and "node" in value:
+            value = value["node"]
+        return value
+
+    root = [data]
+    stack: List[Tuple[Any, Any]] = [(root, 0)]
+    while stack:
+        parent, key = stack.pop()
+        value = unwrap(parent[key])
+        if isinstance(value, list):
+            value = list(value)
+            stack.extend(
+                (value, i) for i, v in enumerate(value) if isinstance(v, (list, dict))
+            )
+        elif isinstance(value, dict):
+            value = dict(value)
+            stack.extend(
+                (value, k) for k, v in value.items() if isinstance(v, (list, dict))
+            )
+        parent[key] = value
+
+    return root[0]
+
+
 def normalize_results(result: str) -> str:
     if result in ("passed", "softfailed"):
         return "passed"
@@ -48,22 +87,150 @@ def normalize_results(result: str) -> str:
     return "failed"
 
 
-def __retry(retries: Optional[int], backoff_factor: float) -> Session:
+def load_json(path: Path, default: Any = None) -> Any:
+    """Load json state file, missing or broken file returns default"""
+    try:
+        with path.open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def dump_json(path: Path, data: Any) -> None:
+    """Atomically replace json state file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile("w", dir=path.parent, delete=False) as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(f.name, path)
+
+
+# worker threads of thread pools and max connections per host, see configure_http()
+JOBS = 8
+POOL_SIZE = 8
+# number of hosts with kept-alive connections per session
+POOL_CONNECTIONS = 10
+
+_sessions: List[Tuple[Session, Retry]] = []
+
+
+def thread_pool(max_workers: Optional[int] = None) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=max_workers or JOBS)
+
+
+def _mount(http: Session, retry: Retry) -> None:
+    # block instead of opening connections above POOL_SIZE which would be
+    # discarded afterwards
     adapter = HTTPAdapter(
-        max_retries=Retry(
-            retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=frozenset({404, 403, 413, 429, 503}),
-        )
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_SIZE,
+        pool_block=True,
+        max_retries=retry,
     )
-    http = Session()
     http.mount("https://", adapter)
     http.mount("http://", adapter)
 
+
+def configure_http(jobs: int, pool_size: Optional[int] = None) -> None:
+    """Set size of thread pools and connection pools of all sessions,
+    connection pool defaults to one connection per worker thread"""
+    global JOBS, POOL_SIZE
+    JOBS = jobs
+    POOL_SIZE = pool_size or jobs
+    for http, retry in _sessions:
+        _mount(http, retry)
+
+
+class Throttle:
+    """Token bucket rate limit and adaptive concurrency limit for one host.
+
+    The concurrency limit starts small, grows by about one per limit
+    requests while latency stays under target_latency and halves on
+    every overloaded response, it never exceeds max_limit or JOBS."""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        initial: int = 2,
+        max_limit: Optional[int] = None,
+        target_latency: float = 2.0,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.limit = float(initial)
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.inflight = 0
+        self.cond = Condition()
+        self.latencies: List[float] = []
+        self.stats: Counter = Counter()
+
+    def _wait_token(self) -> None:
+        throttled = False
+        while True:
+            with self.cond:
+                now = monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                if not throttled:
+                    throttled = True
+                    self.stats["throttled"] += 1
+            sleep(wait)
+
+    def acquire(self) -> None:
+        with self.cond:
+            self.cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+        self._wait_token()
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        with self.cond:
+            self.inflight -= 1
+            self.latencies.append(latency)
+            self.stats["requests"] += 1
+            if overloaded:
+                self.stats["overloaded"] += 1
+                self.limit = max(1.0, self.limit / 2)
+            elif latency <= self.target_latency:
+                self.limit = min(self.max_limit or JOBS, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+def __retry(
+    retries: Optional[int],
+    backoff_factor: float,
+    status_forcelist: FrozenSet[int] = frozenset({404, 403, 413, 429, 503}),
+    respect_retry_after_header: bool = True,
+) -> Session:
+    retry = Retry(
+        retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        respect_retry_after_header=respect_retry_after_header,
+    )
+    http = Session()
+    http.headers.update(
+        {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    )
+    _mount(http, retry)
+    _sessions.append((http, retry))
+
     return http
 
 
 no_retry = __retry(None, 0)
 retry3 = __retry(3, 2)
 retry5 = __retry(5, 1)
+# missing resource is a valid answer, don't retry on 404/403
+retry5_fail_fast = __retry(5, 1, frozenset({413, 429, 503}))
 retry10 = __retry(10, 0.1)
+# 429 and 5xx responses are left to Throttle users, see loader.smelt
+retry10_throttled = __retry(10, 0.1, frozenset({404, 403, 413}), False)
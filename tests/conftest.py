@@ -0,0 +1,8 @@
+import pytest
+
+from openqabot.loader.qem import dashboard
+
+
+@pytest.fixture(autouse=True)
+def clear_dashboard_cache():
+    dashboard.clear()
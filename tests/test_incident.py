@@ -30,10 +30,10 @@ test_data = {
 
 @pytest.fixture
 def mock_good(monkeypatch):
-    def fake(*args, **kwargs):
-        return 12345
+    def fake(repos, *args, **kwargs):
+        return {archver: 12345 for archver in repos}
 
-    monkeypatch.setattr(openqabot.types.incident, "get_max_revision", fake)
+    monkeypatch.setattr(openqabot.types.incident, "get_revisions", fake)
 
 
 @pytest.fixture
@@ -41,7 +41,7 @@ def mock_ex(monkeypatch):
     def fake(*args, **kwargs):
         raise NoRepoFoundError
 
-    monkeypatch.setattr(openqabot.types.incident, "get_max_revision", fake)
+    monkeypatch.setattr(openqabot.types.incident, "get_revisions", fake)
 
 
 def test_inc_normal(mock_good):
@@ -76,6 +76,14 @@ def test_inc_norepo(mock_ex):
         inc = Incident(test_data)
 
 
+def test_inc_norepo_deferred(mock_ex):
+    inc = Incident(test_data, resolve=False)
+    assert inc.revisions == {}
+
+    with pytest.raises(NoRepoFoundError):
+        inc.resolve_revisions()
+
+
 def test_inc_nopackage(mock_good):
     bad_data = deepcopy(test_data)
     bad_data["packages"] = []
@@ -1,12 +1,18 @@
 from collections import namedtuple
 import logging
+import threading
 import pytest
 import responses
 from urllib.parse import urlparse
 import openqabot.incsyncres
+import openqabot.utils
 from openqabot.incsyncres import IncResultsSync
 
-namespace = namedtuple("Namespace", ["dry", "token", "openqa_instance"])
+namespace = namedtuple(
+    "Namespace",
+    ["dry", "token", "openqa_instance", "retry", "force_full_sync", "no_cache"],
+    defaults=[2, False, True],
+)
 
 
 @pytest.fixture
@@ -333,3 +339,80 @@ def test_passed_dry(get_a_i, caplog):
         "Dry run -- data in dashboard untouched",
         "End of bot run",
     ] == messages
+
+
+@pytest.fixture
+def get_a_i_two(monkeypatch):
+    def fake(*args):
+        return [100, 101]
+
+    monkeypatch.setattr(openqabot.incsyncres, "get_active_incidents", fake)
+
+
+@responses.activate
+def test_settings_error_dry(get_a_i_two, caplog):
+    caplog.set_level(logging.DEBUG)
+
+    data = [
+        {
+            "id": 110,
+            "flavor": "FakeFlavor",
+            "arch": "arch",
+            "settings": {"DISTRI": "linux", "BUILD": "123"},
+            "version": "13.3",
+        }
+    ]
+    responses.add(
+        method="GET",
+        url="http://dashboard.qam.suse.de/api/incident_settings/100",
+        json=data,
+    )
+    responses.add(
+        method="GET",
+        url="http://dashboard.qam.suse.de/api/incident_settings/101",
+        json={"error": "not found"},
+    )
+    data = {"jobs": []}
+    responses.add(
+        method="GET",
+        url="http://instance.qa/api/v1/jobs?scope=relevant&latest=1&flavor=FakeFlavor&distri=linux&build=123&version=13.3&arch=arch",
+        json=data,
+    )
+
+    args = namespace(False, "ToKeN", urlparse("http://instance.qa"))
+
+    syncer = IncResultsSync(args)
+
+    ret = syncer()
+    assert ret == 0
+    messages = [x[-1] for x in caplog.record_tuples]
+    assert "Getting settings for 100" in messages
+    assert "Getting settings for 101" in messages
+    assert (
+        "Getting openQA tests results for Data(incident=100, settings_id=110, "
+        "flavor='FakeFlavor', arch='arch', distri='linux', version='13.3', "
+        "build='123', product='')"
+    ) in messages
+    assert len(responses.calls) == 3
+
+
+def test_openqa_not_queued_behind_settings(get_a_i_two, monkeypatch):
+    monkeypatch.setattr(openqabot.utils, "JOBS", 1)
+    queried = threading.Event()
+
+    def fake_settings(token, inc):
+        # settings of the second incident wait for openQA query of the first
+        if inc == 101:
+            assert queried.wait(5)
+        return [inc]
+
+    def fake_jobs(data):
+        queried.set()
+        return []
+
+    monkeypatch.setattr(
+        openqabot.incsyncres, "get_incident_settings_data", fake_settings
+    )
+    syncer = IncResultsSync(namespace(True, "ToKeN", urlparse("http://instance.qa")))
+    monkeypatch.setattr(syncer.client, "get_jobs", fake_jobs)
+    assert syncer() == 0
@@ -1,8 +1,23 @@
+from datetime import date
 from pathlib import Path
 import logging
+import os
+import shutil
+
+import pytest
 
 from openqabot.loader.config import *
-from openqabot.types import Data
+import openqabot.loader.config
+import openqabot.utils
+from openqabot.loader.config import (
+    CACHE_FILE,
+    ChannelIndex,
+    CSafeLoader,
+    MetadataCache,
+    configure,
+)
+from openqabot.types import Data, Repos
+from openqabot.utils import load_json
 
 __root__ = Path(__file__).parent / "fixtures/config"
 
@@ -88,3 +103,190 @@ def test_read_products(caplog):
     assert any(x.endswith("empty config") for x in messages)
     assert any(x.endswith("does not have aggregate") for x in messages)
     assert "'DISTRI'" in messages
+
+
+def test_load_metadata_cache(caplog, tmp_path):
+    caplog.set_level(logging.DEBUG, logger="bot.loader.config")
+    configs = tmp_path / "configs"
+    shutil.copytree(__root__, configs)
+    configure(tmp_path)
+    try:
+        first = load_metadata(configs, False, False, set())
+        assert (tmp_path / CACHE_FILE).exists()
+
+        # new process, touched and changed files
+        configure(tmp_path)
+        os.utime(configs / "01_single.yml")
+        normal = configs / "05_normal.yml"
+        normal.write_text(normal.read_text().replace("SOME15SP3", "OTHER15SP3"))
+        second = load_metadata(configs, False, False, set())
+    finally:
+        configure(None)
+
+    assert "Metadata cache: 0 hits, 5 parsed" in caplog.messages
+    assert "Metadata cache: 4 hits, 1 parsed" in caplog.messages
+    assert [str(r) for r in first] == [
+        r.replace("OTHER", "SOME") for r in map(str, second)
+    ]
+    assert "<Incidents product: OTHER15SP3>" == str(second[1])
+
+
+def test_metadata_cache_json(tmp_path):
+    (tmp_path / CACHE_FILE).write_text("not json")
+    plain = tmp_path / "plain.yml"
+    plain.write_text("a: [1, 2]\n")
+    dates = tmp_path / "dates.yml"
+    dates.write_text("a: 2022-01-01\n1: x\n")
+
+    cache = MetadataCache(tmp_path / CACHE_FILE)
+    assert cache.data == {}
+    cache.put(plain, {"a": [1, 2]})
+    cache.put(dates, {"a": date(2022, 1, 1), 1: "x"})
+    cache.save()
+
+    cache = MetadataCache(tmp_path / CACHE_FILE)
+    assert cache.get(plain) == {"a": [1, 2]}
+    assert cache.get(dates) is openqabot.loader.config._MISSING
+    assert list(load_json(tmp_path / CACHE_FILE)) == [str(plain.absolute())]
+
+
+YAML_TRICKY = """
+a: 017
+b: 0o17
+c: 1_000
+d: yes
+e: 1:30
+f: 2022-01-01
+g: .5
+h: 0x1F
+i: [off, TRUE, ~, null, -0b11, 1e5]
+base: &base {x: 1}
+merged:
+  <<: *base
+  y: 2
+"""
+
+
+@pytest.mark.skipif(not CSafeLoader, reason="PyYAML with libyaml not available")
+def test_libyaml_like_ruamel(tmp_path):
+    tricky = tmp_path / "tricky.yml"
+    tricky.write_text(YAML_TRICKY)
+    duplicate = tmp_path / "duplicate.yml"
+    duplicate.write_text("a: 1\na: 2\n")
+    paths = [tricky, duplicate] + sorted(__root__.glob("*.yml"))
+
+    def load(backend):
+        configure(None, backend)
+        return [
+            type(data) if isinstance(data, Exception) else data
+            for _, data in openqabot.loader.config._load_all(paths)
+        ]
+
+    try:
+        libyaml = load("libyaml")
+        ruamel = load("ruamel")
+    finally:
+        configure(None)
+
+    assert libyaml == ruamel
+    assert ruamel[0]["a"] == 17 and ruamel[0]["d"] == "yes"
+    assert issubclass(ruamel[1], Exception)
+
+
+def test_load_metadata_parallel(monkeypatch):
+    monkeypatch.setattr(openqabot.loader.config, "PARALLEL_MIN_FILES", 1)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    pools = []
+
+    class Pool(openqabot.loader.config.ProcessPoolExecutor):
+        def __init__(self, max_workers):
+            pools.append(max_workers)
+            super().__init__(max_workers=max_workers)
+
+    monkeypatch.setattr(openqabot.loader.config, "ProcessPoolExecutor", Pool)
+
+    # sequential by default
+    configure(None)
+    load_metadata(__root__, False, False, set())
+    assert pools == []
+
+    configure(None, jobs=8)
+    try:
+        result = load_metadata(__root__, False, False, set())
+    finally:
+        configure(None)
+
+    assert pools == [2]
+
+    assert [str(r) for r in result] == [
+        "<Aggregate product: SOME15SP3>",
+        "<Incidents product: SOME15SP3>",
+    ]
+
+
+def test_registry(monkeypatch):
+    configure(None)
+    parsed = []
+    load_all = openqabot.loader.config._load_all
+
+    def f_load_all(paths):
+        ret = load_all(paths)
+        parsed.extend(p.name for p, _ in ret)
+        return ret
+
+    monkeypatch.setattr(openqabot.loader.config, "_load_all", f_load_all)
+
+    # directory of the singlearch file isn't loaded yet, only the file is parsed
+    assert get_onearch(__root__ / "01_single.yml")
+    assert parsed == ["01_single.yml"]
+    assert __root__ not in openqabot.loader.config._registries
+    parsed.clear()
+
+    configs = load_metadata(__root__, False, False, set())
+    products = read_products(__root__)
+    extrasettings = get_onearch(__root__ / "01_single.yml")
+
+    assert sorted(parsed) == sorted(p.name for p in __root__.glob("*.yml"))
+    assert len(configs) == 2 and len(products) == 2
+    assert extrasettings == {"package_one", "package_three", "package_two"}
+
+    meta = registry(__root__)
+    assert sorted(meta.products()) == ["BAD15SP3", "SOME15SP3"]
+    assert [str(c) for c in meta.incidents(set())] == ["<Incidents product: SOME15SP3>"]
+    assert [str(c) for c in meta.aggregates()] == ["<Aggregate product: SOME15SP3>"]
+    assert len(parsed) == 5
+
+    # like the bot: singlearch file in metadata directory is parsed with it
+    configure(None)
+    parsed.clear()
+    meta = registry(__root__)
+    extrasettings = meta.singlearch(__root__ / "01_single.yml")
+    configs = meta.configs(False, False, extrasettings)
+    assert sorted(parsed) == sorted(p.name for p in __root__.glob("*.yml"))
+    assert configs[1].singlearch == {"package_one", "package_three", "package_two"}
+
+
+def test_channel_index():
+    aggregate, incidents = load_metadata(__root__, False, False, set())
+    index = ChannelIndex([aggregate, incidents])
+
+    entries = index.get(Repos("Module", "15-SP3", "x86_64"))
+    assert (aggregate, "Server-DVD-Updates", "BASE_TEST_ISSUES") in entries
+    assert (incidents, "Server-DVD-Incidents", "BASE_TEST_ISSUES") in entries
+    # only the aggregate is on aarch64
+    assert index.get(Repos("Module", "15-SP3", "aarch64")) == [
+        (aggregate, "Server-DVD-Updates", "BASE_TEST_ISSUES")
+    ]
+    assert index.get(Repos("Module", "15-SP4", "x86_64")) == []
+
+    class FakeIncident:
+        def __init__(self, *channels):
+            self.channels = [Repos(*c) for c in channels]
+
+    both = FakeIncident(("Product", "15-SP3", "x86_64"))
+    aarch64 = FakeIncident(("Python2", "15-SP3", "aarch64"))
+    other = FakeIncident(("Product", "12-SP5", "x86_64"))
+
+    matched = index.match([both, aarch64, other])
+    assert matched[aggregate] == [both, aarch64]
+    assert matched[incidents] == [both]
@@ -0,0 +1,188 @@
+from copy import deepcopy
+import logging
+import re
+import threading
+
+import pytest
+import responses
+
+import openqabot.loader.repohash
+import openqabot.types.incident
+import openqabot.utils
+from openqabot.errors import NoRepoFoundError
+from openqabot.loader.qem import (
+    dashboard,
+    get_active_incidents,
+    get_incidents_approver,
+    get_incidents,
+    resolve_revisions,
+    update_incidents,
+    update_incidents_chunk,
+    write_revisions_snapshot,
+)
+from openqabot.types import ArchVer
+from openqabot.utils import dump_json
+
+from .test_incident import test_data
+
+
+def patch_revisions(monkeypatch, fake):
+    """Use fake get_revisions for single and batched resolution"""
+
+    def fake_many(pairs, *args, **kwargs):
+        ret = []
+        for repos, project in pairs:
+            try:
+                ret.append(fake(repos, project))
+            except NoRepoFoundError as e:
+                ret.append(e)
+        return ret
+
+    monkeypatch.setattr(openqabot.types.incident, "get_revisions", fake)
+    monkeypatch.setattr(openqabot.loader.repohash, "get_revisions_many", fake_many)
+
+
+@pytest.fixture
+def mock_revisions(monkeypatch):
+    def fake(repos, project, *args, **kwargs):
+        if project == "SUSE:Maintenance:2":
+            raise NoRepoFoundError
+        return {archver: 12345 for archver in repos}
+
+    patch_revisions(monkeypatch, fake)
+
+
+@responses.activate
+def test_get_incidents(mock_revisions, caplog):
+    caplog.set_level(logging.DEBUG, logger="bot.loader.qem")
+    incidents = []
+    for number in range(1, 5):
+        inc = deepcopy(test_data)
+        inc["number"] = number
+        inc["project"] = f"SUSE:Maintenance:{number}"
+        incidents.append(inc)
+    incidents[2]["packages"] = []
+    responses.add(
+        responses.GET, "http://dashboard.qam.suse.de/api/incidents", json=incidents
+    )
+
+    ret = get_incidents({})
+
+    assert [inc.id for inc in ret] == [1, 4]
+    assert ret[0].revisions[ArchVer("x86_64", "15-SP4")] == 12345
+    messages = [m[-1] for m in caplog.record_tuples]
+    assert (
+        "Project SUSE:Maintenance:2 can't calculate repohash  .. skipping" in messages
+    )
+    assert (
+        "Project SUSE:Maintenance:3 has empty packages - check incident in SMELT"
+        in messages
+    )
+
+
+@responses.activate
+def test_get_incidents_snapshot(mock_revisions, monkeypatch, tmp_path):
+    incidents = []
+    for number in range(1, 4):
+        inc = deepcopy(test_data)
+        inc["number"] = number
+        inc["project"] = f"SUSE:Maintenance:{number}"
+        incidents.append(inc)
+    responses.add(
+        responses.GET, "http://dashboard.qam.suse.de/api/incidents", json=incidents
+    )
+
+    parsed = get_incidents({}, resolve=False)
+    write_revisions_snapshot(tmp_path / "s.json", parsed, resolve_revisions(parsed))
+
+    # next bot run, incident 5 isn't in snapshot and is resolved from download server
+    incidents.append(deepcopy(incidents[0]))
+    incidents[-1]["number"] = 5
+    incidents[-1]["project"] = "SUSE:Maintenance:5"
+    responses.replace(
+        responses.GET, "http://dashboard.qam.suse.de/api/incidents", json=incidents
+    )
+
+    def fake(repos, *args, **kwargs):
+        return {archver: 1 for archver in repos}
+
+    patch_revisions(monkeypatch, fake)
+
+    dashboard.clear()
+    ret = get_incidents({}, tmp_path / "s.json")
+
+    assert [inc.id for inc in ret] == [1, 3, 5]
+    assert ret[0].revisions[ArchVer("x86_64", "15-SP4")] == 12345
+    assert ret[2].revisions[ArchVer("x86_64", "15-SP4")] == 1
+
+
+@responses.activate
+@pytest.mark.parametrize("created", [None, "yesterday"])
+def test_get_incidents_snapshot_invalid(mock_revisions, tmp_path, caplog, created):
+    responses.add(
+        responses.GET,
+        "http://dashboard.qam.suse.de/api/incidents",
+        json=[dict(test_data, number=1, project="SUSE:Maintenance:1")],
+    )
+    snapshot = {"incidents": {"1": [["x86_64", "15-SP4", 1]]}}
+    if created:
+        snapshot["created"] = created
+    dump_json(tmp_path / "s.json", snapshot)
+
+    ret = get_incidents({}, tmp_path / "s.json")
+
+    assert ret[0].revisions[ArchVer("x86_64", "15-SP4")] == 12345
+    assert (
+        f"Invalid revisions snapshot {tmp_path / 's.json'}, using download server"
+        in caplog.messages
+    )
+
+
+@responses.activate
+def test_dashboard_cache(caplog):
+    caplog.set_level(logging.DEBUG, logger="bot.loader.qem")
+    data = [dict(test_data, number=1), dict(test_data, number=2, inReviewQAM=False)]
+    rsp = responses.add(
+        responses.GET, "http://dashboard.qam.suse.de/api/incidents", json=data
+    )
+    responses.add(responses.PATCH, "http://dashboard.qam.suse.de/api/incidents")
+
+    assert sorted(get_active_incidents({})) == [1, 2]
+    assert [inc.inc for inc in get_incidents_approver({})] == [1]
+    assert rsp.call_count == 1
+
+    update_incidents({}, data)
+    get_active_incidents({})
+    assert rsp.call_count == 2
+
+    dashboard.log_stats()
+    assert "Dashboard cache api/incidents: 1 hits, 2 misses" in caplog.messages
+
+
+@responses.activate
+def test_update_incidents_chunk(monkeypatch):
+    monkeypatch.setattr(openqabot.utils, "JOBS", 3)
+    started = threading.Barrier(3, timeout=5)
+    failed = set()
+
+    def reply_callback(request):
+        # all incidents of the chunk are sent at once
+        started.wait()
+        number = request.url.rsplit("/", 1)[-1]
+        if number == "2" and number not in failed:
+            failed.add(number)
+            return (500, {}, "")
+        return (200, {}, "")
+
+    rsp = responses.add_callback(
+        responses.PATCH,
+        re.compile(r"http://dashboard.qam.suse.de/api/incidents/\d+"),
+        callback=reply_callback,
+    )
+    data = [{"number": n} for n in range(1, 4)]
+
+    assert update_incidents_chunk({}, data, retry=0) == 2
+    started = threading.Barrier(1, timeout=5)
+    failed.clear()
+    assert update_incidents_chunk({}, data[1:2], retry=1) == 0
+    assert rsp.call_count == 5
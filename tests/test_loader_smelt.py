@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+
+import pytest
+import responses
+from responses import registries
+from jsonschema import ValidationError
+
+from openqabot.loader import smelt
+from openqabot.loader.smelt import get_incidents, iter_active_incidents
+
+
+def incident_node(number):
+    return {
+        "edges": [
+            {
+                "node": {
+                    "emu": False,
+                    "project": f"SUSE:Maintenance:{number}",
+                    "repositories": {
+                        "edges": [{"node": {"name": "SUSE:SLE-15:Update"}}]
+                    },
+                    "requestSet": {"edges": []},
+                    "packages": {"edges": [{"node": {"name": "xrdp"}}]},
+                }
+            }
+        ]
+    }
+
+
+@responses.activate
+def test_get_incidents_batch():
+    def reply_callback(request):
+        assert not request.params
+        numbers = re.findall(r"i(\d+):", json.loads(request.body)["query"])
+        data = {f"i{n}": incident_node(n) for n in numbers if n != "102"}
+        return (200, {}, json.dumps({"data": data}))
+
+    responses.add_callback(
+        responses.POST, "https://smelt.suse.de/graphql", callback=reply_callback
+    )
+
+    ret = get_incidents({100, 101, 102, 103, 104}, batch_size=2)
+
+    assert len(responses.calls) == 3
+    assert sorted(inc["project"] for inc in ret) == [
+        f"SUSE:Maintenance:{n}" for n in (100, 101, 103, 104)
+    ]
+    assert ret[0]["packages"] == [{"name": "xrdp"}]
+
+
+@responses.activate
+def test_iter_active_incidents():
+    def reply_callback(request):
+        query = request.params["query"]
+        assert "first: 2" in query
+        after = re.search(r'after: "(\d+)"', query)
+        start = int(after.group(1)) if after else 100
+        edges = [
+            {"node": dict(incident_node(n)["edges"][0]["node"], incidentId=n)}
+            for n in range(start, min(start + 2, 105))
+        ]
+        page = {"hasNextPage": start + 2 < 105, "endCursor": str(start + 2)}
+        data = {"incidents": {"pageInfo": page, "edges": edges}}
+        return (200, {}, json.dumps({"data": data}))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r"https://smelt.suse.de/graphql\?query=.*"),
+        callback=reply_callback,
+    )
+
+    incidents = iter_active_incidents(page_size=2)
+    first = next(incidents)
+    # only the first page is fetched before the first incident is processed
+    assert len(responses.calls) == 1
+    assert first["incidentId"] == 100
+    assert first["packages"] == [{"name": "xrdp"}]
+
+    rest = list(incidents)
+    assert len(responses.calls) == 3
+    assert [inc["incidentId"] for inc in rest] == [101, 102, 103, 104]
+
+
+@pytest.mark.parametrize("fast_check", [False, True])
+@responses.activate
+def test_iter_active_incidents_invalid_node(fast_check, caplog):
+    caplog.set_level(logging.INFO, logger="bot.loader.smelt")
+
+    def node(n, **kwargs):
+        return {"node": dict(incident_node(n)["edges"][0]["node"], **kwargs)}
+
+    edges = [node(100, incidentId=100), node(101, incidentId=101, emu="no")]
+    edges.append(node(102, incidentId=102))
+    del edges[-1]["node"]["project"]
+    if not fast_check:
+        # fast check rejects whole page without incidentId
+        edges.append(node(103))
+    page = {"hasNextPage": False, "endCursor": "4"}
+    responses.add(
+        responses.GET,
+        re.compile(r"https://smelt.suse.de/graphql\?query=.*"),
+        json={"data": {"incidents": {"pageInfo": page, "edges": edges}}},
+    )
+
+    smelt.configure(fast_check)
+    try:
+        incidents = list(iter_active_incidents(page_size=4))
+    finally:
+        smelt.configure()
+
+    assert [inc["incidentId"] for inc in incidents] == [100]
+    assert "Invalid data from SMELT for incident 101" in caplog.messages
+    assert "Invalid data from SMELT for incident 102" in caplog.messages
+    skipped = 2 if fast_check else 3
+    assert f"Loaded 1 active incidents, {skipped} invalid skipped" in caplog.messages
+
+
+@pytest.mark.parametrize("fast_check", [False, True])
+def test_validate_incident(fast_check):
+    smelt.configure(fast_check)
+    try:
+        smelt.validate_incident({"data": {"incidents": incident_node(100)}})
+        with pytest.raises(ValidationError):
+            smelt.validate_incident({"data": {}})
+        with pytest.raises(ValidationError):
+            smelt.validate_active({"data": {"incidents": {"edges": []}}})
+    finally:
+        smelt.configure()
+
+
+@responses.activate(registry=registries.OrderedRegistry)
+def test_get_json_overloaded(monkeypatch, caplog):
+    caplog.set_level(logging.INFO, logger="bot.loader.smelt")
+    delays = []
+    monkeypatch.setattr(smelt, "sleep", delays.append)
+    smelt.configure(rate=1000)
+    url = "https://smelt.suse.de/graphql"
+    responses.add(responses.GET, url, status=429, headers={"Retry-After": "3"})
+    responses.add(responses.GET, url, status=503)
+    responses.add(responses.GET, url, json={"data": {}})
+
+    assert smelt.get_json("{}") == {"data": {}}
+    assert delays == [3.0, smelt.BACKOFF * 2]
+    assert smelt._throttle.stats["overloaded"] == 2
+    # halved twice to the minimum, then grown by the successful response
+    assert smelt._throttle.limit == 2
+
+    smelt.log_stats()
+    assert "SMELT requests: 3, overloaded: 2" in caplog.messages[-1]
+    smelt.configure()
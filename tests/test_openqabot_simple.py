@@ -8,6 +8,7 @@ import responses
 from openqabot.openqabot import OpenQABot
 import openqabot.openqabot
 from openqabot.errors import PostOpenQAError
+from openqabot.types import Repos
 
 Namespace = namedtuple(
     "Namespace",
@@ -20,7 +21,9 @@ Namespace = namedtuple(
         "configs",
         "disable_aggregates",
         "disable_incidents",
+        "revisions_snapshot",
     ],
+    defaults=[None],
 )
 
 
@@ -54,29 +57,37 @@ def mock_openqa_exception(monkeypatch):
 
 @pytest.fixture
 def mock_runtime(monkeypatch):
+    class FakeIncident:
+        channels = [Repos("SLES", "15-SP3", "x86_64")]
+
     class FakeWorker:
         def __init__(self, *args, **kwargs):
             pass
 
+        def channels(self):
+            yield Repos("SLES", "15-SP3", "x86_64"), "Server-DVD", "OS_TEST_ISSUES"
+
         def __call__(self, *args, **kwargs):
             return [
                 {"qem": {"fake": "result"}, "openqa": {"fake", "result"}, "api": "bar"}
             ]
 
-    def f_load_metadata(*args, **kwds):
-        return [FakeWorker()]
+    class FakeRegistry:
+        def __init__(self, path):
+            pass
 
-    monkeypatch.setattr(openqabot.openqabot, "load_metadata", f_load_metadata)
+        def singlearch(self, path):
+            return set()
 
-    def f_get_incidents(*args, **kwds):
-        return [123]
+        def configs(self, *args):
+            return [FakeWorker()]
 
-    monkeypatch.setattr(openqabot.openqabot, "get_incidents", f_get_incidents)
+    monkeypatch.setattr(openqabot.openqabot, "registry", FakeRegistry)
 
-    def f_get_onearch(*args, **kwds):
-        return set()
+    def f_get_incidents(*args, **kwds):
+        return [FakeIncident()]
 
-    monkeypatch.setattr(openqabot.openqabot, "get_onearch", f_get_onearch)
+    monkeypatch.setattr(openqabot.openqabot, "get_incidents", f_get_incidents)
 
 
 @responses.activate
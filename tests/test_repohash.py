@@ -5,6 +5,7 @@ import openqabot.loader.repohash
 import pytest
 import responses
 from openqabot.errors import NoRepoFoundError
+from openqabot.types import ArchVer
 from requests import ConnectionError, HTTPError
 
 BASE_XML = '<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm"><revision>%s</revision></repomd>'
@@ -12,6 +13,13 @@ SLES = BASE_XML % "256"
 PROJECT = "SUSE:Maintenance:12345"
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    rp.clear_cache()
+    yield
+    rp.configure(None)
+
+
 @responses.activate
 def test_get_max_revison_manager_aarch64():
     repos = [("SLE-Module-SUSE-Manager-Server", "4.1")]
@@ -122,5 +130,224 @@ def test_get_max_revison_exception(caplog):
     assert "Failed" == str(caplog.records[0].msg)
 
 
+@responses.activate
+def test_get_revisions():
+    add_sles_sled_response(BASE_XML % "257")
+    responses.add(
+        responses.GET,
+        url="http://download.suse.de/ibs/SUSE:/Maintenance:/12345/SUSE_Updates_SLES_15SP3_aarch64/repodata/repomd.xml",
+        body=BASE_XML % "300",
+    )
+    ret = rp.get_revisions(
+        {
+            ArchVer("x86_64", "15SP3"): repos,
+            ArchVer("aarch64", "15SP3"): [("SLES", "15SP3")],
+        },
+        PROJECT,
+        max_workers=2,
+    )
+    assert ret == {ArchVer("x86_64", "15SP3"): 257, ArchVer("aarch64", "15SP3"): 300}
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_get_revisions_norepo():
+    add_sles_sled_response(ConnectionError("Failed"))
+
+    with pytest.raises(NoRepoFoundError):
+        rp.get_revisions({ArchVer("x86_64", "15SP3"): repos}, PROJECT)
+
+
+@responses.activate
+def test_get_max_revision_single_flight():
+    add_sles_sled_response(BASE_XML % "257")
+
+    assert rp.get_max_revision(repos, arch, PROJECT) == 257
+    assert rp.get_max_revision(repos, arch, PROJECT) == 257
+    ret = rp.get_revisions(
+        {ArchVer("x86_64", "15SP3"): repos, ArchVer("x86_64", "15"): repos}, PROJECT
+    )
+    assert ret == {ArchVer("x86_64", "15SP3"): 257, ArchVer("x86_64", "15"): 257}
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_get_max_revision_single_flight_norepo():
+    add_sles_sled_response(ConnectionError("Failed"))
+
+    for _ in range(2):
+        with pytest.raises(NoRepoFoundError):
+            rp.get_max_revision(repos, arch, PROJECT)
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_get_max_revision_single_flight_exception():
+    add_sles_sled_response(Exception("Failed"))
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            rp.get_max_revision(repos, arch, PROJECT)
+    # SLES revision is cached, unexpected SLED failure is retried
+    assert len(responses.calls) == 3
+
+
+SLES_URL = "http://download.suse.de/ibs/SUSE:/Maintenance:/12345/SUSE_Updates_SLES_15SP3_x86_64/repodata/repomd.xml"
+
+
+@responses.activate
+def test_get_max_revision_persistent_cache(tmp_path):
+    rp.configure(tmp_path)
+    responses.add(responses.GET, SLES_URL, body=SLES, headers={"ETag": '"abc"'})
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    rp.save_cache()
+
+    # next bot run
+    rp.clear_cache()
+    rp.configure(tmp_path)
+    responses.replace(responses.GET, SLES_URL, status=304)
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    assert responses.calls[1].request.headers["If-None-Match"] == '"abc"'
+
+
+@responses.activate
+def test_get_max_revision_negative_cache(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG, logger="bot.loader.repohash")
+    rp.configure(tmp_path)
+    responses.add(responses.GET, SLES_URL, status=404)
+    with pytest.raises(NoRepoFoundError):
+        rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT)
+    # 404 is not retried
+    assert len(responses.calls) == 1
+    rp.save_cache()
+
+    # next bot run
+    rp.clear_cache()
+    rp.configure(tmp_path)
+    with pytest.raises(NoRepoFoundError):
+        rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT)
+    assert len(responses.calls) == 1
+    assert rp.stats["negative_hits"] == 1
+    assert caplog.records[-1].msg == f"{SLES_URL} known missing -- skip incident"
+
+    # expired negative cache entry
+    rp.clear_cache()
+    rp.configure(tmp_path, missing_ttl=0)
+    with pytest.raises(NoRepoFoundError):
+        rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT)
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_get_max_revision_head_check(tmp_path):
+    rp.configure(tmp_path, head_check=True)
+    headers = {"Last-Modified": "Tue, 18 Oct 2022 10:00:00 GMT"}
+    responses.add(responses.GET, SLES_URL, body=SLES, headers=headers)
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    rp.save_cache()
+
+    # next bot run, unchanged repository
+    rp.clear_cache()
+    rp.configure(tmp_path, head_check=True)
+    responses.add(responses.HEAD, SLES_URL, headers=headers)
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    assert [c.request.method for c in responses.calls] == ["GET", "HEAD"]
+    assert rp.stats["head_hits"] == 1
+
+    # next bot run, changed repository
+    rp.clear_cache()
+    rp.configure(tmp_path, head_check=True)
+    headers = {"Last-Modified": "Wed, 19 Oct 2022 10:00:00 GMT"}
+    responses.replace(responses.HEAD, SLES_URL, headers=headers)
+    responses.replace(responses.GET, SLES_URL, body=BASE_XML % "257")
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 257
+    assert [c.request.method for c in responses.calls][2:] == ["HEAD", "GET"]
+
+
+@responses.activate
+def test_get_max_revision_head_check_fallback(tmp_path):
+    rp.configure(tmp_path, head_check=True)
+    responses.add(
+        responses.GET, SLES_URL, body=SLES, headers={"Content-Length": str(len(SLES))}
+    )
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    rp.save_cache()
+
+    # next bot run, Content-Length alone is not enough for HEAD pre-check
+    rp.clear_cache()
+    rp.configure(tmp_path, head_check=True)
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    assert [c.request.method for c in responses.calls] == ["GET", "GET"]
+
+    # failing HEAD falls back to GET instead of skipping the incident
+    rp.clear_cache()
+    rp.configure(tmp_path, head_check=True)
+    headers = {"Last-Modified": "Tue, 18 Oct 2022 10:00:00 GMT"}
+    responses.replace(responses.GET, SLES_URL, body=SLES, headers=headers)
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    rp.save_cache()
+    rp.clear_cache()
+    rp.configure(tmp_path, head_check=True)
+    responses.add(responses.HEAD, SLES_URL, body=ConnectionError())
+    assert rp.get_max_revision([("SLES", "15SP3")], arch, PROJECT) == 256
+    assert [c.request.method for c in responses.calls][3:] == ["HEAD", "GET"]
+    assert rp.stats["head_hits"] == 0
+
+
+def test_revision_cache_evict(tmp_path):
+    cache = rp.RevisionCache(tmp_path / "cache.json", max_age=100, max_entries=2)
+    for rev in range(4):
+        cache.put(f"url{rev}", {}, rev)
+    cache.data["url3"]["checked"] -= 200
+    cache.save()
+
+    cache = rp.RevisionCache(tmp_path / "cache.json")
+    assert set(cache.data) == {"url1", "url2"}
+
+
+def test_parse_revision_stops_at_revision():
+    def chunks():
+        yield b'<repomd xmlns="http://linux.duke.edu/metadata/repo">'
+        yield b"<revision>42</revision>"
+        raise AssertionError("read past revision")
+
+    assert rp.parse_revision(chunks()) == "42"
+
+
+def test_parse_revision_missing():
+    assert rp.parse_revision([b"<invalid></invalid>"]) is None
+
+
 def test_merge_repohash():
     assert "c7e84e227cb118dbe1fa7d49b3e55fc3" == rp.merge_repohash(["a", "b", "c"])
+
+
+@responses.activate
+def test_get_revisions_many(monkeypatch):
+    add_sles_sled_response(BASE_XML % "257")
+    responses.add(
+        responses.GET,
+        url="http://download.suse.de/ibs/SUSE:/Maintenance:/1/SUSE_Updates_SLES_15SP3_x86_64/repodata/repomd.xml",
+        status=404,
+    )
+    pools = []
+    thread_pool = rp.thread_pool
+
+    def f_thread_pool(*args, **kwargs):
+        pools.append(args)
+        return thread_pool(*args, **kwargs)
+
+    monkeypatch.setattr(rp, "thread_pool", f_thread_pool)
+
+    ret = rp.get_revisions_many(
+        [
+            ({ArchVer("x86_64", "15SP3"): repos}, PROJECT),
+            ({ArchVer("x86_64", "15SP3"): [("SLES", "15SP3")]}, "SUSE:Maintenance:1"),
+            ({}, PROJECT),
+        ]
+    )
+
+    assert ret[0] == {ArchVer("x86_64", "15SP3"): 257}
+    assert isinstance(ret[1], NoRepoFoundError)
+    assert ret[2] == {}
+    assert len(pools) == 1
@@ -0,0 +1,65 @@
+from collections import namedtuple
+from copy import deepcopy
+import re
+
+import pytest
+import responses
+from requests import ConnectionError
+
+import openqabot.loader.repohash as rp
+from openqabot.repohashrefresh import RepoHashRefresh
+from openqabot.utils import load_json
+
+from .test_incident import test_data
+
+namespace = namedtuple("Namespace", ["token", "output"])
+
+REPOMD = '<repomd xmlns="http://linux.duke.edu/metadata/repo"><revision>%s</revision></repomd>'
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    rp.clear_cache()
+    yield
+    rp.configure(None)
+
+
+@responses.activate
+def test_refresh(tmp_path, caplog):
+    incidents = []
+    for number in range(1, 3):
+        inc = deepcopy(test_data)
+        inc["number"] = number
+        inc["project"] = f"SUSE:Maintenance:{number}"
+        incidents.append(inc)
+    responses.add(
+        responses.GET, "http://dashboard.qam.suse.de/api/incidents", json=incidents
+    )
+    responses.add(
+        responses.GET,
+        re.compile(r"http://download\.suse\.de/ibs/SUSE:/Maintenance:/1/.*"),
+        body=REPOMD % "1234",
+    )
+    responses.add(
+        responses.GET,
+        re.compile(r"http://download\.suse\.de/ibs/SUSE:/Maintenance:/2/.*"),
+        body=ConnectionError(),
+    )
+
+    output = tmp_path / "revisions.json"
+    assert RepoHashRefresh(namespace("ToKeN", output))() == 0
+
+    snapshot = load_json(output, {})
+    assert "created" in snapshot
+    assert snapshot["incidents"]["2"] is None
+    assert sorted(snapshot["incidents"]["1"]) == [
+        ["aarch64", "15-SP4", 1234],
+        ["x86_64", "15-SP4", 1234],
+        ["x86_64", "15.4", 1234],
+    ]
+    assert "Revisions of 1 incidents written to %s" % output in caplog.text
+    assert all(
+        c.request.headers["Authorization"] == "Token ToKeN"
+        for c in responses.calls
+        if "dashboard" in c.request.url
+    )
@@ -1,4 +1,5 @@
 from collections import namedtuple
+import json
 import logging
 import re
 
@@ -7,10 +8,18 @@ import pytest
 import responses
 
 import openqabot.smeltsync
-from openqabot.smeltsync import SMELTSync
+from openqabot.smeltsync import SMELTSync, STATE_FILE
+from openqabot.utils import dump_json, load_json
 
 # Fake Namespace for SyncRes initialization
-_namespace = namedtuple("Namespace", ("dry", "token", "retry"))
+_namespace = namedtuple(
+    "Namespace",
+    ("dry", "token", "retry", "delta", "chunk_size", "cache_dir", "no_cache")
+    + ("batch_size", "inline", "page_size", "fast_check", "incremental")
+    + ("full_resync", "smelt_rate", "stream", "snapshot_max_age"),
+    defaults=(False, 100, None, True, 1, False, 100, False, False, False, 100.0)
+    + (False, 86400),
+)
 
 
 @pytest.fixture(scope="function")
@@ -90,7 +99,7 @@ def fake_dashboard_replyback():
 @responses.activate
 @pytest.mark.parametrize("fake_qem", [()], indirect=True)
 @pytest.mark.parametrize(
-    "fake_smelt_api", [(["qam-openqa", "new", "review"])], indirect=True
+    "fake_smelt_api", [["qam-openqa", "new", "review"]], indirect=True
 )
 def test_sync_qam_inreview(fake_qem, caplog, fake_smelt_api, fake_dashboard_replyback):
     caplog.set_level(logging.DEBUG, logger="bot.syncres")
@@ -109,7 +118,7 @@ def test_sync_qam_inreview(fake_qem, caplog, fake_smelt_api, fake_dashboard_repl
 @responses.activate
 @pytest.mark.parametrize("fake_qem", [()], indirect=True)
 @pytest.mark.parametrize(
-    "fake_smelt_api", [(["qam-openqa", "accepted", "new"])], indirect=True
+    "fake_smelt_api", [["qam-openqa", "accepted", "new"]], indirect=True
 )
 def test_sync_approved(fake_qem, caplog, fake_smelt_api, fake_dashboard_replyback):
     caplog.set_level(logging.DEBUG, logger="bot.syncres")
@@ -123,3 +132,204 @@ def test_sync_approved(fake_qem, caplog, fake_smelt_api, fake_dashboard_replybac
     assert responses.calls[1].response.json()[0]["inReviewQAM"] == False
     assert responses.calls[1].response.json()[0]["isActive"] == False
     assert responses.calls[1].response.json()[0]["approved"] == True
+
+
+@responses.activate
+@pytest.mark.parametrize("fake_qem", [()], indirect=True)
+@pytest.mark.parametrize(
+    "fake_smelt_api", [["qam-openqa", "new", "review"]], indirect=True
+)
+def test_sync_delta(fake_qem, caplog, fake_smelt_api, tmp_path):
+    caplog.set_level(logging.DEBUG, logger="bot.smeltsync")
+    full = responses.add(responses.PATCH, "http://dashboard.qam.suse.de/api/incidents")
+    single = responses.add(
+        responses.PATCH, re.compile(r"http://dashboard.qam.suse.de/api/incidents/\d+")
+    )
+    args = _namespace(False, "123", 0, True, 1, tmp_path, False)
+
+    # no state -> full sync
+    assert SMELTSync(args)() == 0
+    assert full.call_count == 1
+
+    # nothing changed
+    assert SMELTSync(args)() == 0
+    assert "Delta sync: 0 changed and 0 removed incidents" in caplog.messages
+    assert full.call_count == 1
+    assert single.call_count == 0
+
+    # incident 100 removed, incident 101 added
+    state = load_json(tmp_path / STATE_FILE)
+    state["101"] = dict(state.pop("100"), number=101)
+    dump_json(tmp_path / STATE_FILE, state)
+    assert SMELTSync(args)() == 0
+    assert "Delta sync: 1 changed and 1 removed incidents" in caplog.messages
+    assert single.call_count == 2
+    assert responses.calls[-1].request.url.endswith("/api/incidents/101")
+    assert json.loads(responses.calls[-1].request.body)["isActive"] == False
+    assert list(load_json(tmp_path / STATE_FILE)) == ["100"]
+
+
+@responses.activate
+def test_sync_incremental(caplog, tmp_path):
+    caplog.set_level(logging.INFO, logger="bot.smeltsync")
+
+    def node(number, status):
+        return {
+            "node": {
+                "incidentId": number,
+                "status": {"name": status},
+                "emu": False,
+                "project": f"SUSE:Maintenance:{number}",
+                "repositories": {"edges": []},
+                "requestSet": {"edges": []},
+                "packages": {"edges": [{"node": {"name": "xrdp"}}]},
+            }
+        }
+
+    changed = {"incidents": [], "requests": [], "reviews": []}
+    failing = False
+
+    def reply_callback(request):
+        query = request.params["query"]
+        if failing and "modified_Gte" in query:
+            return (400, {}, json.dumps({"errors": [{"message": "Unknown"}]}))
+        root = re.match(r"{ (\w+)\(", query).group(1)
+        edges = changed[root] if "modified_Gte" in query else [node(100, "active")]
+        page = {"hasNextPage": False, "endCursor": "1"}
+        data = {"data": {root: {"pageInfo": page, "edges": edges}}}
+        return (200, {}, json.dumps(data))
+
+    smelt = responses.add_callback(
+        responses.GET,
+        re.compile(r"https://smelt.suse.de/graphql\?query=.*"),
+        callback=reply_callback,
+    )
+    dashboard = responses.add(
+        responses.PATCH, "http://dashboard.qam.suse.de/api/incidents"
+    )
+
+    def synced(**kwargs):
+        args = _namespace(False, "123", 0, cache_dir=tmp_path, no_cache=False)
+        assert SMELTSync(args._replace(incremental=True, **kwargs))() == 0
+        body = json.loads(responses.calls[-1].request.body)
+        return [inc["number"] for inc in body]
+
+    # no snapshot -> all active incidents
+    assert synced() == [100]
+    assert "status_Name_Iexact" in smelt.calls[-1].request.params["query"]
+    snapshot = load_json(tmp_path / openqabot.smeltsync.SNAPSHOT_FILE)
+    assert list(snapshot["incidents"]) == ["100"]
+
+    # incident 100 done, incident 101 new
+    changed["incidents"] = [node(100, "done"), node(101, "active")]
+    assert synced() == [101]
+    assert "modified_Gte" in smelt.calls[-1].request.params["query"]
+
+    # changes of requests and reviews which didn't modify their incident
+    changed["incidents"] = []
+    changed["requests"] = [{"node": {"incident": node(102, "active")["node"]}}]
+    changed["reviews"] = [
+        {"node": {"request": {"incident": node(101, "done")["node"]}}},
+        {"node": {"request": {"incident": None}}},
+    ]
+    assert synced() == [102]
+    queries = [c.request.params["query"] for c in smelt.calls[-3:]]
+    assert [q.split("(")[0] for q in queries] == [
+        "{ incidents",
+        "{ requests",
+        "{ reviews",
+    ]
+
+    assert synced(full_resync=True) == [100]
+    assert "status_Name_Iexact" in smelt.calls[-1].request.params["query"]
+    assert dashboard.call_count == 4
+
+    # snapshot too old
+    assert synced(snapshot_max_age=-1) == [100]
+    assert "SMELT snapshot older than -1s, full resync" in caplog.messages
+    assert "status_Name_Iexact" in smelt.calls[-1].request.params["query"]
+
+    # query of changes fails
+    failing = True
+    assert synced() == [100]
+    assert "modified_Gte" in smelt.calls[-2].request.params["query"]
+    assert "status_Name_Iexact" in smelt.calls[-1].request.params["query"]
+    messages = caplog.messages
+    assert any(m.startswith("Query of changed incidents failed") for m in messages)
+
+
+@responses.activate
+@pytest.mark.parametrize("fake_qem", [()], indirect=True)
+@pytest.mark.parametrize(
+    "fake_smelt_api", [["qam-openqa", "new", "review"]], indirect=True
+)
+def test_sync_stream(fake_qem, caplog, fake_smelt_api):
+    caplog.set_level(logging.INFO, logger="bot.smeltsync")
+    responses.add(
+        responses.GET,
+        "http://dashboard.qam.suse.de/api/incidents",
+        json=[{"number": 100, "isActive": True}, {"number": 200, "isActive": True}],
+    )
+    single = responses.add(
+        responses.PATCH, re.compile(r"http://dashboard.qam.suse.de/api/incidents/\d+")
+    )
+
+    assert SMELTSync(_namespace(False, "123", 0, stream=True))() == 0
+    assert "Synced 1 incidents, 1 removed" in caplog.messages
+    assert not any(m.startswith("Data:") for m in caplog.messages)
+    assert single.call_count == 2
+    urls = [c.request.url for c in responses.calls if c.request.method == "PATCH"]
+    assert urls[0].endswith("/api/incidents/100")
+    assert urls[1].endswith("/api/incidents/200")
+    assert json.loads(responses.calls[-1].request.body)["isActive"] == False
+
+
+@responses.activate
+@pytest.mark.parametrize("fake_qem", [()], indirect=True)
+@pytest.mark.parametrize(
+    "fake_smelt_api", [["qam-openqa", "new", "review"]], indirect=True
+)
+def test_sync_stream_dry(fake_qem, caplog, fake_smelt_api):
+    caplog.set_level(logging.INFO, logger="bot.smeltsync")
+    assert SMELTSync(_namespace(True, "123", 0, stream=True))() == 0
+    assert "--stream is ignored with --dry or --delta" in caplog.messages
+    assert "Dry run, nothing synced" in caplog.messages
+
+
+@responses.activate
+@pytest.mark.parametrize("stream", [False, True])
+def test_sync_inline_invalid_page(caplog, stream):
+    node = {
+        "incidentId": 100,
+        "emu": False,
+        "project": "SUSE:Maintenance:100",
+        "repositories": {"edges": []},
+        "requestSet": {"edges": []},
+        "packages": {"edges": [{"node": {"name": "xrdp"}}]},
+    }
+
+    def reply_callback(request):
+        if "after" in request.params["query"]:
+            return (200, {}, json.dumps({"data": {}}))
+        page = {"hasNextPage": True, "endCursor": "1"}
+        edges = [{"node": node}]
+        data = {"data": {"incidents": {"pageInfo": page, "edges": edges}}}
+        return (200, {}, json.dumps(data))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r"https://smelt.suse.de/graphql\?query=.*"),
+        callback=reply_callback,
+    )
+    dashboard = responses.add(
+        responses.GET, "http://dashboard.qam.suse.de/api/incidents", json=[]
+    )
+    bulk = responses.add(responses.PATCH, "http://dashboard.qam.suse.de/api/incidents")
+    responses.add(
+        responses.PATCH, re.compile(r"http://dashboard.qam.suse.de/api/incidents/\d+")
+    )
+
+    args = _namespace(False, "123", 0, inline=True, stream=stream)
+    assert SMELTSync(args)() == 1
+    assert dashboard.call_count == 0
+    assert bulk.call_count == 0
@@ -0,0 +1,65 @@
+from collections import namedtuple
+import json
+import logging
+from urllib.parse import urlparse
+
+import responses
+
+from openqabot.syncres import SyncRes
+
+namespace = namedtuple(
+    "Namespace",
+    ["dry", "token", "openqa_instance", "retry", "force_full_sync", "no_cache"]
+    + ["cache_dir"],
+    defaults=[False, True, None],
+)
+
+
+@responses.activate
+def test_post_results(caplog):
+    caplog.set_level(logging.DEBUG, logger="bot.syncres")
+    attempts = {}
+
+    def reply_callback(request):
+        job_id = json.loads(request.body)["job_id"]
+        attempts[job_id] = attempts.get(job_id, 0) + 1
+        # job 2 fails once, job 3 always
+        if job_id == 3 or (job_id == 2 and attempts[job_id] == 1):
+            return (400, {}, "broken")
+        return (200, {}, "{}")
+
+    responses.add_callback(
+        responses.PUT, "http://dashboard.qam.suse.de/api/jobs", callback=reply_callback
+    )
+
+    syncer = SyncRes(namespace(False, "ToKeN", urlparse("https://openqa.suse.de"), 1))
+    syncer.post_results([{"job_id": i, "status": "passed"} for i in range(1, 5)])
+
+    assert attempts == {1: 1, 2: 2, 3: 2, 4: 1}
+    assert syncer.stats == {"posted": 3, "failed": 1, "retried": 2}
+    assert "Posting job 3 failed: broken" in caplog.messages
+    assert "Results posted: 3, failed: 1, retried: 2, unchanged: 0" in caplog.messages
+
+
+@responses.activate
+def test_post_results_unchanged(caplog, tmp_path):
+    caplog.set_level(logging.DEBUG, logger="bot.syncres")
+    rsp = responses.add(responses.PUT, "http://dashboard.qam.suse.de/api/jobs")
+    results = [{"job_id": i, "status": "passed"} for i in range(1, 3)]
+
+    def args(force):
+        url = urlparse("https://openqa.suse.de")
+        return namespace(False, "ToKeN", url, 0, force, False, tmp_path)
+
+    SyncRes(args(False)).post_results(results)
+    assert rsp.call_count == 2
+
+    results[1]["status"] = "failed"
+    syncer = SyncRes(args(False))
+    syncer.post_results(results)
+    assert rsp.call_count == 3
+    assert syncer.stats["suppressed"] == 1
+    assert "Results posted: 1, failed: 0, retried: 0, unchanged: 1" in caplog.messages
+
+    SyncRes(args(True)).post_results(results)
+    assert rsp.call_count == 5
@@ -1,3 +1,5 @@
+from copy import deepcopy
+
 import pytest
 import responses
 
@@ -14,7 +16,8 @@ except ImportError as e:
 
     logging.info(str(e) + ": Likely older python version")
 
-from openqabot.utils import walk, normalize_results, retry3
+import openqabot.utils
+from openqabot.utils import Throttle, flatten, walk, normalize_results, retry3
 
 
 def test_normalize_results():
@@ -88,8 +91,25 @@ def test_normalize_results():
     ],
 )
 def test_walk(data, result):
-    ret = walk(data)
+    ret = walk(deepcopy(data))
+    assert result == ret
+
+    orig = deepcopy(data)
+    ret = flatten(data)
     assert result == ret
+    assert orig == data
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"edges": {"edges": [{"node": {"edges": [{"node": {"v": 1}}]}}]}},
+        {"a": [{"node": {"node": {"b": 1}}}, [{"edges": []}], 2, None]},
+        {"node": {"a": {"node": {"c": "d"}}, "b": [{"x": 1, "node": 2}]}},
+    ],
+)
+def test_flatten_like_walk(data):
+    assert flatten(data) == walk(deepcopy(data))
 
 
 if has_registries:
@@ -103,3 +123,40 @@ if has_registries:
         req = retry3.get("http://host.some")
         assert req.status_code == 200
         assert rsp3.call_count == 1
+
+
+def test_configure_http(monkeypatch):
+    monkeypatch.setattr(openqabot.utils, "JOBS", openqabot.utils.JOBS)
+    monkeypatch.setattr(openqabot.utils, "POOL_SIZE", openqabot.utils.POOL_SIZE)
+
+    openqabot.utils.configure_http(16)
+    assert retry3.get_adapter("http://host.some")._pool_maxsize == 16
+    with openqabot.utils.thread_pool() as executor:
+        assert executor._max_workers == 16
+
+    openqabot.utils.configure_http(4, 20)
+    adapter = retry3.get_adapter("https://host.some")
+    assert adapter._pool_maxsize == 20
+    assert adapter._pool_block
+    assert adapter.max_retries.total == 3
+
+    openqabot.utils.configure_http(8)
+
+
+def test_throttle():
+    throttle = Throttle(1000, burst=10, initial=2, max_limit=4)
+    for _ in range(20):
+        throttle.acquire()
+        throttle.release(0.1)
+    assert throttle.limit == 4
+    assert throttle.inflight == 0
+
+    throttle.acquire()
+    throttle.release(0.1, overloaded=True)
+    assert throttle.limit == 2
+    # slow responses don't grow the limit
+    throttle.acquire()
+    throttle.release(10)
+    assert throttle.limit == 2
+    assert throttle.stats["requests"] == 22
+    assert throttle.stats["overloaded"] == 1